@@ -0,0 +1,396 @@
+import asyncio
+import itertools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import chess
+
+import metrics
+from chess_ai import SimpleAI, get_difficulty_settings
+
+# Number of worker processes that may search at the same time
+AI_WORKERS = max(1, int(os.environ.get('AI_WORKERS', os.cpu_count() or 1)))
+
+# How many recently cancelled job IDs each lane remembers; only jobs that
+# are already running need one, as queued jobs are cancelled in the executor
+CANCEL_SLOTS = 16
+
+# Optional pondering: keep searching on the opponent's predicted reply
+# while the human thinks, for at most AI_PONDER_SECONDS per game
+AI_PONDER = os.environ.get('AI_PONDER', '0') == '1'
+PONDER_SECONDS = float(os.environ.get('AI_PONDER_SECONDS', 10))
+
+# Games whose SimpleAI (and transposition table) a worker keeps in memory
+MAX_GAMES_PER_WORKER = int(os.environ.get('AI_GAMES_PER_WORKER', 16))
+
+# Backpressure: once the expected queue wait passes AI_DEGRADE_WAIT seconds
+# new searches get proportionally less time (never under AI_MIN_TIME_LIMIT),
+# and past AI_BUSY_WAIT seconds new AI moves are refused
+AI_DEGRADE_WAIT = float(os.environ.get('AI_DEGRADE_WAIT', 3))
+AI_BUSY_WAIT = float(os.environ.get('AI_BUSY_WAIT', 20))
+AI_MIN_TIME_LIMIT = float(os.environ.get('AI_MIN_TIME_LIMIT', 0.25))
+
+# Fairness: a game's search time counts against its next searches, halving
+# every AI_USAGE_HALF_LIFE seconds, and each second spent waiting in the
+# queue is worth AI_AGING seconds of priority
+AI_USAGE_HALF_LIFE = float(os.environ.get('AI_USAGE_HALF_LIFE', 60))
+AI_AGING = float(os.environ.get('AI_AGING', 1))
+
+AI_QUEUE_DEPTH = metrics.Gauge('chess_ai_queue_depth', "AI searches waiting for a worker")
+AI_RUNNING = metrics.Gauge('chess_ai_running', "AI searches running")
+AI_QUEUE_WAIT = metrics.Histogram('chess_ai_queue_wait_seconds', "Time AI searches waited for a worker")
+AI_DEGRADED = metrics.Counter('chess_ai_degraded_total', "AI searches given less time because of the queue")
+AI_REJECTED = metrics.Counter('chess_ai_rejected_total', "AI moves refused because the queue was full")
+
+# SimpleAI instances living inside a worker process, least recently used first
+# Key: game key (channel ID)
+# Value: SimpleAI for that game's difficulty
+_worker_ais = {}
+
+def _get_worker_ai(game_key, difficulty):
+    """Get (or create) the SimpleAI used for a game inside this worker"""
+    ai = _worker_ais.pop(game_key, None)
+    if ai is None or ai.level != difficulty:
+        ai = SimpleAI(difficulty)
+        while len(_worker_ais) >= MAX_GAMES_PER_WORKER:
+            del _worker_ais[next(iter(_worker_ais))]
+    _worker_ais[game_key] = ai
+    return ai
+
+# Shared array of cancelled job IDs for the lane this worker serves
+_cancelled_jobs = None
+
+def _init_worker(cancelled_jobs):
+    """Worker initializer: remember the lane's shared cancellation list"""
+    global _cancelled_jobs
+    _cancelled_jobs = cancelled_jobs
+
+class _CancelFlag:
+    """Event-like flag that is set once the pool cancels a job"""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+    def is_set(self):
+        return _cancelled_jobs is not None and self.job_id in _cancelled_jobs[:]
+
+def _run_search(job_id, game_key, root_fen, moves, difficulty, time_limit, node_limit):
+    """Worker entry point: rebuild the position from FEN plus moves and search it"""
+    board = chess.Board(root_fen)
+    for uci in moves:
+        board.push_uci(uci)
+
+    ai = _get_worker_ai(game_key, difficulty)
+    best_move = ai.get_best_move(board, time_limit=time_limit, node_limit=node_limit,
+                                 cancel_event=_CancelFlag(job_id))
+    return (best_move.uci() if best_move else None), ai.stats
+
+def _run_ponder(job_id, game_key, root_fen, moves, difficulty, time_limit):
+    """Worker entry point: ponder on the human's predicted reply"""
+    board = chess.Board(root_fen)
+    for uci in moves:
+        board.push_uci(uci)
+
+    ai = _get_worker_ai(game_key, difficulty)
+    predicted = ai.ponder(board, time_limit=time_limit, cancel_event=_CancelFlag(job_id))
+    return predicted.uci() if predicted else None
+
+class _Job:
+    """A search waiting for, or running on, a lane"""
+
+    __slots__ = ('job_id', 'game_key', 'args', 'cost', 'lane', 'future', 'enqueued', 'started', 'cancelled')
+
+    def __init__(self, job_id, game_key, args, cost, lane, future):
+        self.job_id = job_id
+        self.game_key = game_key
+        self.args = args
+        self.cost = cost
+        self.lane = lane
+        self.future = future
+        self.enqueued = time.monotonic()
+        self.started = None
+        self.cancelled = False
+
+class _Lane:
+    """A single worker process plus the shared list used to cancel its jobs"""
+
+    def __init__(self, context):
+        self.cancelled = context.Array('q', CANCEL_SLOTS)
+        self.next_slot = 0
+
+        # The search running on this lane, if any
+        self.job = None
+
+        # Ponder jobs queued or running on this lane
+        # Key: game key
+        # Value: (job ID, executor future)
+        self.ponder_jobs = {}
+        self.executor = ProcessPoolExecutor(
+            max_workers=1, mp_context=context,
+            initializer=_init_worker, initargs=(self.cancelled,)
+        )
+
+    def cancel(self, job_id):
+        """Ask the worker to stop a running or queued job"""
+        self.cancelled[self.next_slot] = job_id
+        self.next_slot = (self.next_slot + 1) % CANCEL_SLOTS
+
+    def stop_ponder(self, game_key):
+        """Cancel a game's ponder job, if it has one"""
+        ponder = self.ponder_jobs.pop(game_key, None)
+        if ponder is not None:
+            job_id, future = ponder
+            # A job still queued is dropped; only a running one must be told to stop
+            if not future.cancel():
+                self.cancel(job_id)
+
+    def stop_pondering(self):
+        """Cancel every ponder job so real searches never wait behind one"""
+        for game_key in list(self.ponder_jobs):
+            self.stop_ponder(game_key)
+
+class AIPool:
+    """Bounded pool of worker processes that run SimpleAI searches
+
+    Each worker is its own single-process executor ("lane") and every game
+    prefers one lane, so the per-game state a worker keeps between moves
+    stays warm while different games still search in parallel.
+
+    The lanes are the CPU budget of games: at most one search runs on each.
+    Searches wait in one queue, and whenever a lane is free the pool starts
+    the waiting search with the lowest priority value. That value is the
+    search's time limit, plus the game's recently used search time, minus
+    the time it has waited. Cheap searches therefore go first, a game
+    cannot hog the workers, and nothing starves. A free lane takes a search
+    pinned to a busy lane rather than sit idle. When the queue gets long,
+    new searches are given less time, and AI moves are eventually refused
+    (see overloaded()).
+    """
+
+    def __init__(self, workers=AI_WORKERS, ponder=AI_PONDER):
+        self.workers = workers
+        self.ponder = ponder
+        self.lanes = []
+        self.context = None
+        self.job_ids = itertools.count(1)
+        self.loop = None
+
+        # Searches waiting for a lane, in arrival order
+        self.waiting = []
+
+        # Searches waiting or running
+        # Key: game key
+        # Value: _Job
+        self.pending = {}
+
+        # Recent search time per game, for fairness
+        # Key: game key
+        # Value: (seconds, time.monotonic() when recorded)
+        self.usage = {}
+
+        AI_QUEUE_DEPTH.callback = lambda: len(self.waiting)
+        AI_RUNNING.callback = lambda: sum(lane.job is not None for lane in self.lanes)
+
+    def _lane_for(self, game_key):
+        """Get the lane a game is pinned to, starting the lanes on first use"""
+        if not self.lanes:
+            # Spawn (rather than fork) so workers never inherit the bot's
+            # gateway connection, event loop or keep-alive thread
+            self.context = multiprocessing.get_context('spawn')
+            self.lanes = [_Lane(self.context) for _ in range(self.workers)]
+        return self.lanes[hash(game_key) % len(self.lanes)]
+
+    def _replace_lane(self, lane):
+        """Swap a lane whose worker died (e.g. killed for memory) for a fresh one"""
+        if lane not in self.lanes:
+            return
+        print("AI worker process died; starting a new one")
+        new_lane = _Lane(self.context)
+        self.lanes[self.lanes.index(lane)] = new_lane
+        lane.executor.shutdown(wait=False, cancel_futures=True)
+        for job in self.waiting:
+            if job.lane is lane:
+                job.lane = new_lane
+
+    def expected_wait(self):
+        """Seconds a search queued now would probably wait for a lane"""
+        now = time.monotonic()
+        work = sum(job.cost for job in self.waiting)
+        for lane in self.lanes:
+            if lane.job is not None:
+                work += max(0.0, lane.job.cost - (now - lane.job.started))
+        return work / (len(self.lanes) or self.workers)
+
+    def overloaded(self):
+        """Whether the queue is too long to accept another AI move"""
+        if self.expected_wait() > AI_BUSY_WAIT:
+            AI_REJECTED.inc()
+            return True
+        return False
+
+    def _recent_usage(self, game_key, now):
+        seconds, recorded = self.usage.get(game_key, (0.0, now))
+        return seconds * 0.5 ** ((now - recorded) / AI_USAGE_HALF_LIFE)
+
+    def _priority(self, job, now):
+        if job.cancelled:
+            return float('-inf')
+        return job.cost + self._recent_usage(job.game_key, now) - (now - job.enqueued) * AI_AGING
+
+    async def search(self, game_key, board, difficulty):
+        """Search a position in a worker process without blocking the event loop
+
+        Returns (best move, search stats). The stats include how long the
+        search waited for a worker and whether it was given less time.
+        """
+        root_fen = board.root().fen()
+        moves = [move.uci() for move in board.move_stack]
+
+        settings = get_difficulty_settings(difficulty)
+        time_limit = settings['time_limit']
+        node_limit = settings['node_limit']
+        expected_wait = self.expected_wait()
+        degraded = expected_wait > AI_DEGRADE_WAIT
+        if degraded:
+            # Iterative deepening simply stops at a shallower depth
+            scale = max(AI_MIN_TIME_LIMIT / time_limit, AI_DEGRADE_WAIT / expected_wait)
+            time_limit *= scale
+            node_limit = max(1, int(node_limit * scale))
+            AI_DEGRADED.inc()
+
+        self.loop = asyncio.get_running_loop()
+        job = _Job(next(self.job_ids), game_key, (root_fen, moves, difficulty, time_limit, node_limit),
+                   time_limit, self._lane_for(game_key), self.loop.create_future())
+        self.waiting.append(job)
+        self.pending[game_key] = job
+        self._dispatch()
+
+        try:
+            uci, stats = await job.future
+        finally:
+            if self.pending.get(game_key) is job:
+                del self.pending[game_key]
+            if job in self.waiting:
+                self.waiting.remove(job)
+        stats = dict(stats, wait=job.started - job.enqueued, degraded=degraded)
+        return (chess.Move.from_uci(uci) if uci else None), stats
+
+    def _dispatch(self):
+        """Start waiting searches on free lanes, best priority first"""
+        while self.waiting:
+            idle = [lane for lane in self.lanes if lane.job is None]
+            if not idle:
+                return
+            now = time.monotonic()
+            job = min(self.waiting, key=lambda job: self._priority(job, now))
+            self.waiting.remove(job)
+
+            # Prefer the game's own lane; otherwise borrow a free one
+            lane = job.lane if job.lane.job is None else idle[0]
+            lane.stop_pondering()
+            lane.job = job
+            job.lane = lane
+            job.started = now
+            if job.cancelled:
+                lane.cancel(job.job_id)
+            AI_QUEUE_WAIT.observe(now - job.enqueued)
+
+            try:
+                future = lane.executor.submit(_run_search, job.job_id, job.game_key, *job.args)
+            except Exception as e:
+                # The lane's worker is gone; fail this search rather than leave it hanging
+                lane.job = None
+                if not job.future.done():
+                    job.future.set_exception(e)
+                if isinstance(e, BrokenProcessPool):
+                    self._replace_lane(lane)
+                continue
+            future.add_done_callback(lambda future, job=job: self._on_done(job, future))
+
+    def _on_done(self, job, future):
+        """Executor callback (on its own thread): hand the result to the event loop"""
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._finished, job, future)
+
+    def _finished(self, job, future):
+        """Free a search's lane, charge its time to the game, and start the next search"""
+        job.lane.job = None
+        now = time.monotonic()
+        self.usage[job.game_key] = (self._recent_usage(job.game_key, now) + now - job.started, now)
+        # Forget games that have not searched for a while
+        if len(self.usage) > 4 * MAX_GAMES_PER_WORKER * len(self.lanes):
+            self.usage = {game_key: (seconds, recorded) for game_key, (seconds, recorded) in self.usage.items()
+                          if now - recorded < 4 * AI_USAGE_HALF_LIFE}
+
+        if not job.future.done():
+            if future.cancelled():
+                job.future.cancel()
+            elif future.exception() is not None:
+                job.future.set_exception(future.exception())
+            else:
+                job.future.set_result(future.result())
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            self._replace_lane(job.lane)
+        self._dispatch()
+
+    def start_ponder(self, game_key, board, difficulty):
+        """Ponder on a game in the background after the AI has replied
+
+        Pondering only uses idle time: it stops after PONDER_SECONDS and is
+        cancelled as soon as any game pinned to the same lane needs a real
+        search.
+        """
+        # Only ponder when no real search is waiting for a worker
+        if not self.ponder or board.is_game_over() or self.waiting:
+            return
+
+        root_fen = board.root().fen()
+        moves = [move.uci() for move in board.move_stack]
+
+        lane = self._lane_for(game_key)
+        lane.stop_ponder(game_key)
+        job_id = next(self.job_ids)
+        try:
+            future = lane.executor.submit(
+                _run_ponder, job_id, game_key, root_fen, moves, difficulty, PONDER_SECONDS
+            )
+        except BrokenProcessPool:
+            self._replace_lane(lane)
+            return
+        ponder = lane.ponder_jobs[game_key] = (job_id, future)
+        loop = asyncio.get_running_loop()
+
+        def forget():
+            if lane.ponder_jobs.get(game_key) is ponder:
+                del lane.ponder_jobs[game_key]
+
+        def finished(future):
+            # Runs on the executor's thread; ponder_jobs belongs to the event loop
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(forget)
+            if not future.cancelled() and future.exception():
+                print(f"Error pondering game {game_key}: {future.exception()}")
+
+        future.add_done_callback(finished)
+
+    def cancel(self, game_key):
+        """Stop a game's search and pondering; a waiting caller gets the best move found so far"""
+        job = self.pending.get(game_key)
+        if job:
+            job.cancelled = True
+            if job.started is not None:
+                job.lane.cancel(job.job_id)
+        if self.lanes:
+            self._lane_for(game_key).stop_ponder(game_key)
+
+    def shutdown(self):
+        """Stop all worker processes"""
+        for lane in self.lanes:
+            lane.executor.shutdown(wait=False, cancel_futures=True)
+        self.lanes = []
+        for job in self.waiting:
+            job.future.cancel()
+        self.waiting = []
@@ -0,0 +1,239 @@
+import asyncio
+import collections
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import chess
+import chess.polyglot
+from PIL import Image, ImageDraw
+
+import metrics
+from ai_pool import AI_WORKERS
+from chess_ai import MATE_SCORE, SCORE_TABLES, SimpleAI
+from search_board import SearchBoard, move_to_chess
+from search_cache import get_search_cache
+
+# Worker processes used by /analyze. They are extra processes on top of the
+# AI's (see AIPool), started on first use at a lower priority (nice
+# ANALYSIS_NICE), so games' searches get the CPUs first.
+ANALYSIS_WORKERS = max(1, int(os.environ.get('ANALYSIS_WORKERS', AI_WORKERS // 2)))
+ANALYSIS_NICE = 10
+
+# Search depth and per-position time limit of the analysis
+ANALYSIS_DEPTH = int(os.environ.get('ANALYSIS_DEPTH', 3))
+ANALYSIS_TIME_LIMIT = float(os.environ.get('ANALYSIS_TIME_LIMIT', 2))
+
+# Positions whose evaluation is kept in memory for later analyses
+ANALYSIS_CACHE_SIZE = int(os.environ.get('ANALYSIS_CACHE_SIZE', 50000))
+
+# Least time between progress edits of an /analyze response, in seconds
+ANALYSIS_PROGRESS_INTERVAL = float(os.environ.get('ANALYSIS_PROGRESS_INTERVAL', 1))
+
+# Largest PGN file /analyze reads
+MAX_PGN_BYTES = 100000
+
+# Evaluations are clamped to this many centipawns, so mates don't flatten the graph
+EVAL_CLAMP = 1000
+
+# Centipawns a move must lose, from the mover's point of view, to count
+BLUNDER_LOSS = 300
+MISTAKE_LOSS = 150
+
+GRAPH_WIDTH = 600
+GRAPH_HEIGHT = 200
+
+ANALYSIS_POSITIONS = metrics.Counter(
+    'chess_analysis_positions_total', "Positions evaluated for /analyze, by where the result came from",
+    labels=('source',))
+
+def _init_worker():
+    """Worker initializer: give way to the AI workers"""
+    try:
+        os.nice(ANALYSIS_NICE)
+    except (AttributeError, OSError):
+        pass
+
+# SimpleAI kept by a worker process across positions, so its transposition
+# table helps with the following positions of the same game
+_worker_ai = None
+
+def _evaluate(fen, depth, time_limit):
+    """Worker entry point: evaluate one position; returns (score, best move, depth)
+
+    The score is in centipawns from White's point of view.
+    """
+    global _worker_ai
+    board = chess.Board(fen)
+    search_board = SearchBoard(board, SCORE_TABLES)
+    legal_moves = search_board.legal_moves()
+    if not legal_moves:
+        if board.is_check():
+            return (-MATE_SCORE if board.turn == chess.WHITE else MATE_SCORE), None, 0
+        return 0, None, 0
+
+    if _worker_ai is None:
+        _worker_ai = SimpleAI(20)
+    ai = _worker_ai
+    ai.difficulty = dict(ai.difficulty, depth=depth)
+
+    # Any earlier search of this position, by a game or an analysis
+    cache = get_search_cache()
+    key = search_board.key
+    settings = ai.cache_settings()
+    if cache is not None:
+        cached = cache.get(key, settings, depth)
+        if (cached is not None and cached[1] in legal_moves and cached[2] is not None and
+                ai.cache_safe(search_board, cached[0])):
+            return -cached[2], move_to_chess(cached[1]).uci(), cached[0]
+
+    best_move = ai.search(search_board, legal_moves, time_limit=time_limit, node_limit=float('inf'))
+    score = ai.stats['score']
+    if cache is not None and ai.depth_reached and ai.cache_safe(SearchBoard(board), ai.depth_reached):
+        cache.put(key, settings, ai.depth_reached, best_move, score, ai.stats['nodes'])
+    # Search scores are from Black's point of view
+    return (-score if score is not None else 0), move_to_chess(best_move).uci(), ai.depth_reached
+
+class Analyzer:
+    """Evaluates every position of a game on a pool of worker processes
+
+    Results are kept by Zobrist key and depth, so positions that games have
+    in common (most of all the openings) are evaluated once. A position
+    another analysis is already evaluating is waited for, not evaluated again.
+    The workers also share the AI's disk-backed search cache.
+    """
+
+    def __init__(self, workers=ANALYSIS_WORKERS, depth=ANALYSIS_DEPTH, time_limit=ANALYSIS_TIME_LIMIT,
+                 cache_size=ANALYSIS_CACHE_SIZE):
+        self.workers = workers
+        self.depth = depth
+        self.time_limit = time_limit
+        self.cache_size = cache_size
+        self.executor = None
+
+        # Key: (Zobrist key, depth)
+        # Value: (score, best move UCI, depth reached), least recently used first
+        self.results = collections.OrderedDict()
+
+        # Key: (Zobrist key, depth)
+        # Value: asyncio future of an evaluation in progress
+        self.pending = {}
+
+    async def evaluate(self, board):
+        """Evaluate one position; returns (score, best move UCI, depth)"""
+        key = (chess.polyglot.zobrist_hash(board), self.depth)
+        result = self.results.get(key)
+        if result is not None:
+            self.results.move_to_end(key)
+            ANALYSIS_POSITIONS.inc('memory')
+            return result
+
+        future = self.pending.get(key)
+        if future is not None:
+            ANALYSIS_POSITIONS.inc('shared')
+            return await asyncio.shield(future)
+
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                mp_context=multiprocessing.get_context('spawn'),
+                                                initializer=_init_worker)
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, _evaluate, board.fen(), self.depth, self.time_limit)
+        self.pending[key] = future
+        try:
+            result = await asyncio.shield(future)
+        finally:
+            del self.pending[key]
+        ANALYSIS_POSITIONS.inc('search')
+
+        self.results[key] = result
+        while len(self.results) > self.cache_size:
+            self.results.popitem(last=False)
+        return result
+
+    async def analyze(self, board, progress=None):
+        """Evaluate every position of a game, from its start to board
+
+        progress(done, total) is awaited after each position finishes.
+        Returns one (score, best move UCI, depth) per position.
+        """
+        positions = []
+        replay = board.root()
+        positions.append(replay.copy(stack=False))
+        for move in board.move_stack:
+            replay.push(move)
+            positions.append(replay.copy(stack=False))
+
+        done = 0
+
+        async def evaluate(position):
+            nonlocal done
+            result = await self.evaluate(position)
+            done += 1
+            if progress is not None:
+                await progress(done, len(positions))
+            return result
+
+        return await asyncio.gather(*(evaluate(position) for position in positions))
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+def clamp(score):
+    return max(-EVAL_CLAMP, min(EVAL_CLAMP, score))
+
+def find_mistakes(board, evaluations):
+    """Moves that lost at least MISTAKE_LOSS centipawns
+
+    Returns (ply, the move as e.g. "12... Nf6", SAN of the best move or None,
+    centipawns lost, whether it was a blunder) for each.
+    """
+    mistakes = []
+    replay = board.root()
+    for ply, move in enumerate(board.move_stack):
+        before, best_move, _ = evaluations[ply]
+        after = evaluations[ply + 1][0]
+        sign = 1 if replay.turn == chess.WHITE else -1
+        loss = sign * (clamp(before) - clamp(after))
+        if loss >= MISTAKE_LOSS:
+            best_san = None
+            if best_move is not None and best_move != move.uci():
+                best = chess.Move.from_uci(best_move)
+                if replay.is_legal(best):
+                    best_san = replay.san(best)
+            label = f"{replay.fullmove_number}{'.' if replay.turn == chess.WHITE else '...'} {replay.san(move)}"
+            mistakes.append((ply, label, best_san, loss, loss >= BLUNDER_LOSS))
+        replay.push(move)
+    return mistakes
+
+def draw_eval_graph(evaluations, mistakes=()):
+    """PNG of the evaluation after each ply, White's advantage above the line"""
+    image = Image.new('RGB', (GRAPH_WIDTH, GRAPH_HEIGHT), (49, 46, 43))
+    draw = ImageDraw.Draw(image)
+    middle = GRAPH_HEIGHT // 2
+    count = len(evaluations)
+    step = GRAPH_WIDTH / max(1, count - 1)
+
+    def point(ply):
+        score = clamp(evaluations[ply][0])
+        return ply * step, middle - score * (middle - 4) / EVAL_CLAMP
+
+    points = [point(ply) for ply in range(count)]
+    if count > 1:
+        # White's share of the graph is filled from the bottom up to the curve
+        draw.polygon([(0, GRAPH_HEIGHT)] + points + [(points[-1][0], GRAPH_HEIGHT)], fill=(235, 235, 235))
+    draw.line([(0, middle), (GRAPH_WIDTH, middle)], fill=(128, 128, 128))
+    if count > 1:
+        draw.line(points, fill=(139, 69, 19), width=2)
+
+    for ply, _, _, _, blunder in mistakes:
+        x, y = points[ply + 1]
+        color = (220, 40, 40) if blunder else (240, 160, 40)
+        draw.ellipse([x - 4, y - 4, x + 4, y + 4], fill=color)
+
+    output = io.BytesIO()
+    image.save(output, format='PNG')
+    return output.getvalue()
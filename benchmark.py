@@ -0,0 +1,218 @@
+"""Benchmarks for search, evaluation, rendering and persistence
+
+Run with `python benchmark.py` (or `--quick` for a shorter run). Results
+are written as JSON so runs on different commits can be compared.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+
+import chess
+
+from board_renderer import BoardRenderer, frame_key
+from chess_ai import SCORE_TABLES, SimpleAI
+from game_store import GameStore
+from search_board import PERFT_POSITIONS, SearchBoard
+
+# Fixed positions for the search and evaluation benchmarks
+SEARCH_POSITIONS = [
+    chess.STARTING_FEN,
+    "r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4",
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+    "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+]
+
+def timed(function, *args):
+    """Run a function once; returns (result, seconds)"""
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def bench_perft(depth):
+    """Move generation: perft node counts and speed on the standard positions"""
+    results = []
+    for fen, expected in PERFT_POSITIONS:
+        nodes, elapsed = timed(SearchBoard(chess.Board(fen)).perft, depth)
+        results.append({
+            'fen': fen,
+            'depth': depth,
+            'nodes': nodes,
+            'correct': depth > len(expected) or nodes == expected[depth - 1],
+            'seconds': elapsed,
+            'nps': int(nodes / elapsed),
+        })
+    return results
+
+def bench_search(levels):
+    """SimpleAI search at each difficulty: nodes, depth, time and nps per position"""
+    results = []
+    for level in levels:
+        positions = []
+        for fen in SEARCH_POSITIONS:
+            # A fresh AI per position so earlier searches cannot help later ones
+            ai = SimpleAI(level)
+            search_board = SearchBoard(chess.Board(fen), SCORE_TABLES)
+            ai.search(search_board, search_board.legal_moves())
+            positions.append({key: ai.stats[key] for key in ('nodes', 'depth', 'time', 'nps')})
+
+        nodes = sum(position['nodes'] for position in positions)
+        seconds = sum(position['time'] for position in positions)
+        results.append({
+            'level': level,
+            'nodes': nodes,
+            'seconds': seconds,
+            'nps': int(nodes / seconds) if seconds > 0 else 0,
+            'mean_depth': sum(position['depth'] for position in positions) / len(positions),
+            'positions': positions,
+        })
+    return results
+
+def bench_evaluate(iterations):
+    """evaluate_board throughput on chess.Board and SearchBoard"""
+    ai = SimpleAI()
+    results = {}
+    for name, make_board in (('board', chess.Board),
+                             ('search_board', lambda fen: SearchBoard(chess.Board(fen), SCORE_TABLES))):
+        boards = [make_board(fen) for fen in SEARCH_POSITIONS]
+        start = time.perf_counter()
+        for _ in range(iterations):
+            for board in boards:
+                ai.evaluate_board(board)
+        elapsed = time.perf_counter() - start
+        results[name] = {'evaluations': iterations * len(boards), 'seconds': elapsed,
+                         'per_second': int(iterations * len(boards) / elapsed)}
+    return results
+
+def random_game(plies, seed):
+    """A reproducible random game, stopped early if it ends"""
+    rng = random.Random(seed)
+    board = chess.Board()
+    while board.ply() < plies and not board.is_game_over():
+        board.push(rng.choice(list(board.legal_moves)))
+    return board
+
+def latency(samples):
+    """Summarise a list of durations in milliseconds"""
+    samples = sorted(samples)
+    return {
+        'mean_ms': sum(samples) / len(samples) * 1000,
+        'p50_ms': samples[len(samples) // 2] * 1000,
+        'p95_ms': samples[int(len(samples) * 0.95)] * 1000,
+    }
+
+def bench_render(games):
+    """Board image latency (full, incremental and cached) and PNG size"""
+    renderer = BoardRenderer(cache_size=0)
+    full, incremental, sizes = [], [], []
+    for seed in range(games):
+        game = random_game(80, seed)
+        board = chess.Board()
+        for move in game.move_stack:
+            board.push(move)
+            key = frame_key(board, 10)
+            png, elapsed = timed(renderer._render_key, key)
+            full.append(elapsed)
+            sizes.append(len(png))
+            incremental.append(timed(renderer._render_key, key, seed)[1])
+
+    cached_renderer = BoardRenderer()
+    board = random_game(40, 0)
+    cached_renderer.render(board, 10)
+    cached = [timed(cached_renderer.render, board, 10)[1] for _ in range(1000)]
+
+    return {
+        'full': latency(full),
+        'incremental': latency(incremental),
+        'cached': latency(cached),
+        'png_bytes_mean': sum(sizes) // len(sizes),
+    }
+
+def bench_persistence(game_counts, plies):
+    """GameStore cost of journaling, snapshotting and loading N active games"""
+    results = []
+    moves = random_game(plies, 1).move_stack
+    for count in game_counts:
+        directory = tempfile.mkdtemp(prefix='chess_bench_')
+        try:
+            snapshot_path = os.path.join(directory, 'games.json')
+            journal_path = os.path.join(directory, 'games.journal')
+
+            # Journal every game; closing writes the rest and snapshots everything
+            store = GameStore(snapshot_path, journal_path, compact_every=10 ** 9)
+            store.start({})
+            record_start = time.perf_counter()
+            for channel_id in range(count):
+                store.record_start(channel_id, chess.Board(), (channel_id, None), 'ai', 10)
+                for ply, move in enumerate(moves):
+                    store.record_move(channel_id, move.uci(), ply)
+            record_seconds = time.perf_counter() - record_start
+            _, close_seconds = timed(store.close)
+
+            games, load_seconds = timed(GameStore(snapshot_path, journal_path).load)
+            assert len(games) == count
+
+            results.append({
+                'games': count,
+                'plies': len(moves),
+                'record_us': record_seconds / (count * (len(moves) + 1)) * 1e6,
+                'save_seconds': record_seconds + close_seconds,
+                'close_seconds': close_seconds,
+                'snapshot_bytes': os.path.getsize(snapshot_path),
+                'load_seconds': load_seconds,
+            })
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', default='benchmark.json', help="where to write the JSON results")
+    parser.add_argument('--quick', action='store_true', help="fewer levels, games and iterations")
+    args = parser.parse_args()
+
+    if args.quick:
+        perft_depth, levels, evaluations, render_games, game_counts = 3, [1, 10, 20], 2000, 2, [10, 1000]
+    else:
+        perft_depth, levels, evaluations, render_games, game_counts = 4, list(range(1, 21)), 20000, 10, [10, 1000, 10000]
+
+    random.seed(0)
+
+    results = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'chess': chess.__version__,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'quick': args.quick,
+    }
+    for name, bench, bench_args in (
+        ('perft', bench_perft, (perft_depth,)),
+        ('evaluate', bench_evaluate, (evaluations,)),
+        ('render', bench_render, (render_games,)),
+        ('persistence', bench_persistence, (game_counts, 60)),
+        ('search', bench_search, (levels,)),
+    ):
+        print(f"Running {name} benchmark...")
+        results[name], elapsed = timed(bench, *bench_args)
+        print(f"  done in {elapsed:.1f}s")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+import asyncio
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import chess
+from PIL import Image, ImageDraw, ImageFont
+
+import metrics
+
+# Board dimensions
+SQUARE_SIZE = 50
+LABEL_SIZE = 20
+TITLE_HEIGHT = 30
+BOARD_SIZE = SQUARE_SIZE * 8
+
+# Colors
+LIGHT_SQUARE = '#F0D9B5'
+DARK_SQUARE = '#B58863'
+LIGHT_LAST_MOVE = '#CDD26A'
+DARK_LAST_MOVE = '#AAA23A'
+CHECK_SQUARE = '#E06666'
+
+FONT_PATH = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+BOLD_FONT_PATH = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+
+# Unicode chess pieces (for drawing text)
+PIECE_SYMBOLS = {
+    'P': '♙', 'R': '♖', 'N': '♘', 'B': '♗', 'Q': '♕', 'K': '♔',  # White
+    'p': '♟', 'r': '♜', 'n': '♞', 'b': '♝', 'q': '♛', 'k': '♚'   # Black
+}
+
+# Encoded images kept in memory, and threads that render the rest
+RENDER_CACHE_SIZE = int(os.environ.get('RENDER_CACHE_SIZE', 512))
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', 2))
+
+# Channels whose last drawn frame is kept for incremental redraws
+FRAME_CACHE_SIZE = int(os.environ.get('RENDER_FRAME_CACHE_SIZE', 256))
+
+# zlib level for PNG output; 1 is several times faster than the default 6
+# and only slightly larger for flat board images
+PNG_COMPRESS_LEVEL = int(os.environ.get('RENDER_PNG_COMPRESS_LEVEL', 1))
+
+def load_font(path, size):
+    """Load a TrueType font, falling back to Pillow's built-in font"""
+    try:
+        return ImageFont.truetype(path, size)
+    except OSError:
+        return ImageFont.load_default(size)
+
+def square_origin(square, top=LABEL_SIZE):
+    """Pixel position of a square's top-left corner (White at the bottom)"""
+    return (LABEL_SIZE + chess.square_file(square) * SQUARE_SIZE,
+            top + (7 - chess.square_rank(square)) * SQUARE_SIZE)
+
+def square_color(square):
+    return LIGHT_SQUARE if (chess.square_file(square) + chess.square_rank(square)) % 2 else DARK_SQUARE
+
+def frame_key(board, difficulty=None):
+    """Everything an image of the board depends on: placement, title and highlights"""
+    highlights = []
+    if board.move_stack:
+        last_move = board.peek()
+        for square in (last_move.from_square, last_move.to_square):
+            light = (chess.square_file(square) + chess.square_rank(square)) % 2
+            highlights.append((square, LIGHT_LAST_MOVE if light else DARK_LAST_MOVE))
+    if board.is_check():
+        highlights.append((board.king(board.turn), CHECK_SQUARE))
+    return board.board_fen(), difficulty, tuple(highlights)
+
+class BoardRenderer:
+    """Draws board images from pre-rendered sprites and caches the PNG bytes
+
+    The labelled empty board and one sprite per piece are drawn once, so a
+    render is a copy of the board plus one paste per piece. Encoded images
+    are kept in an LRU cache keyed by frame_key(), and render_async() does
+    the work on a small thread pool.
+
+    When a channel ID is given, the channel's previous frame is kept and the
+    next image is drawn over it, repainting only the squares whose piece or
+    highlight changed (usually two to four per move).
+    """
+
+    def __init__(self, cache_size=RENDER_CACHE_SIZE, workers=RENDER_WORKERS, frame_cache_size=FRAME_CACHE_SIZE):
+        self.cache_size = cache_size
+        self.workers = workers
+        self.frame_cache_size = frame_cache_size
+        self.executor = None
+        self.lock = threading.Lock()
+
+        # Encoded images, least recently used first
+        # Key: frame_key()
+        # Value: PNG bytes
+        self.cache = OrderedDict()
+
+        # Last image drawn for each channel, least recently used first
+        # Key: channel ID
+        # Value: (frame_key(), PIL image)
+        self.frames = OrderedDict()
+
+        # Sprites, built on first use
+        self.empty_boards = {}
+        self.piece_sprites = None
+
+    def _empty_board(self, difficulty):
+        """Get the labelled empty board, with a title for AI games"""
+        empty_board = self.empty_boards.get(difficulty)
+        if empty_board is not None:
+            return empty_board
+
+        title_height = TITLE_HEIGHT if difficulty else 0
+        total_width = BOARD_SIZE + LABEL_SIZE * 2
+        total_height = BOARD_SIZE + LABEL_SIZE * 2 + title_height
+        img = Image.new('RGB', (total_width, total_height), color='white')
+        draw = ImageDraw.Draw(img)
+
+        if difficulty:
+            title_font = load_font(BOLD_FONT_PATH, 20)
+            draw.text((total_width // 2, title_height // 2), f"AI Difficulty: {difficulty}",
+                      fill='black', font=title_font, anchor='mm')
+
+        board_y_offset = LABEL_SIZE + title_height
+        # Top rank first, as each square overlaps its neighbours by a pixel
+        for square in chess.SQUARES_180:
+            x, y = square_origin(square, board_y_offset)
+            draw.rectangle([x, y, x + SQUARE_SIZE, y + SQUARE_SIZE], fill=square_color(square))
+
+        label_font = load_font(FONT_PATH, 12)
+        for i in range(8):
+            # Files (a-h) at bottom and top
+            x = LABEL_SIZE + i * SQUARE_SIZE + SQUARE_SIZE // 2
+            draw.text((x, board_y_offset + BOARD_SIZE + LABEL_SIZE // 2), chess.FILE_NAMES[i],
+                      fill='black', font=label_font, anchor='mm')
+            draw.text((x, board_y_offset - LABEL_SIZE // 2), chess.FILE_NAMES[i],
+                      fill='black', font=label_font, anchor='mm')
+
+            # Ranks (1-8) at left and right, 8 at the top
+            y = board_y_offset + i * SQUARE_SIZE + SQUARE_SIZE // 2
+            draw.text((LABEL_SIZE // 2, y), str(8 - i), fill='black', font=label_font, anchor='mm')
+            draw.text((LABEL_SIZE + BOARD_SIZE + LABEL_SIZE // 2, y), str(8 - i),
+                      fill='black', font=label_font, anchor='mm')
+
+        self.empty_boards[difficulty] = img
+        return img
+
+    def _sprites(self):
+        """Get the piece sprites: a glyph mask per piece symbol"""
+        if self.piece_sprites is None:
+            font = load_font(FONT_PATH, 30)
+            sprites = {}
+            for symbol, glyph in PIECE_SYMBOLS.items():
+                mask = Image.new('L', (SQUARE_SIZE, SQUARE_SIZE), 0)
+                ImageDraw.Draw(mask).text((SQUARE_SIZE // 2, SQUARE_SIZE // 2), glyph,
+                                          fill=255, font=font, anchor='mm')
+                sprites[symbol] = mask
+            self.piece_sprites = sprites
+        return self.piece_sprites
+
+    def draw(self, key, frame=None):
+        """Draw the image for a frame_key(), reusing a previous (key, image) frame if given
+
+        The previous frame's image is drawn over in place.
+        """
+        board_fen, difficulty, highlights = key
+        with self.lock:
+            empty_board = self._empty_board(difficulty)
+            sprites = self._sprites()
+
+        pieces = {square: piece.symbol() for square, piece in chess.BaseBoard(board_fen).piece_map().items()}
+        highlights = dict(highlights)
+        if frame is not None and frame[0][1] == difficulty:
+            previous_key, img = frame
+            previous_pieces = {square: piece.symbol()
+                               for square, piece in chess.BaseBoard(previous_key[0]).piece_map().items()}
+            previous_highlights = dict(previous_key[2])
+        else:
+            img = empty_board.copy()
+            previous_pieces = {}
+            previous_highlights = {}
+
+        top = LABEL_SIZE + (TITLE_HEIGHT if difficulty else 0)
+        draw = ImageDraw.Draw(img)
+        for square in pieces.keys() | previous_pieces.keys() | highlights.keys() | previous_highlights.keys():
+            piece = pieces.get(square)
+            background = highlights.get(square)
+            if piece == previous_pieces.get(square) and background == previous_highlights.get(square):
+                continue
+
+            x, y = square_origin(square, top)
+            if square in previous_pieces or background != previous_highlights.get(square):
+                # Squares on the h-file and first rank own their outer pixel line
+                right = x + SQUARE_SIZE - (chess.square_file(square) != 7)
+                bottom = y + SQUARE_SIZE - (chess.square_rank(square) != 0)
+                draw.rectangle([x, y, right, bottom], fill=background or square_color(square))
+            if piece:
+                img.paste('black', (x, y), sprites[piece])
+        return img
+
+    @staticmethod
+    def encode(img):
+        buffer = io.BytesIO()
+        img.save(buffer, format='PNG', compress_level=PNG_COMPRESS_LEVEL)
+        return buffer.getvalue()
+
+    def _cached(self, key):
+        with self.lock:
+            png = self.cache.get(key)
+            if png is not None:
+                self.cache.move_to_end(key)
+        metrics.RENDER_CACHE.inc('miss' if png is None else 'hit')
+        return png
+
+    def _store(self, key, png):
+        with self.lock:
+            self.cache[key] = png
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def render(self, board, difficulty=None, channel_id=None):
+        """Render a board to PNG bytes, using the cache when possible"""
+        key = frame_key(board, difficulty)
+        png = self._cached(key)
+        if png is None:
+            png = self._render_key(key, channel_id)
+        return png
+
+    async def render_async(self, board, difficulty=None, channel_id=None):
+        """Render a board to PNG bytes on the thread pool"""
+        key = frame_key(board, difficulty)
+        png = self._cached(key)
+        if png is None:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='render')
+            loop = asyncio.get_running_loop()
+            png = await loop.run_in_executor(self.executor, self._render_key, key, channel_id)
+        return png
+
+    def _render_key(self, key, channel_id=None):
+        frame = None
+        if channel_id is not None:
+            # Take the frame so no other thread draws over it meanwhile
+            with self.lock:
+                frame = self.frames.pop(channel_id, None)
+
+        with metrics.RENDER_SECONDS.time('full' if frame is None else 'incremental'):
+            img = self.draw(key, frame)
+            png = self.encode(img)
+        self._store(key, png)
+
+        if channel_id is not None:
+            with self.lock:
+                self.frames[channel_id] = (key, img)
+                while len(self.frames) > self.frame_cache_size:
+                    self.frames.popitem(last=False)
+        return png
+
+    def forget(self, channel_id):
+        """Drop a channel's frame, e.g. once its game is over"""
+        with self.lock:
+            self.frames.pop(channel_id, None)
+
+    def shutdown(self):
+        """Stop the render threads"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
@@ -0,0 +1,114 @@
+import asyncio
+
+import metrics
+
+QUEUED_REQUESTS = metrics.Gauge('chess_queued_requests', "Commands waiting for or holding their channel")
+COLLAPSED_REQUESTS = metrics.Counter(
+    'chess_collapsed_requests_total', "Requests dropped as duplicates of, or superseded by, another request",
+    labels=('reason',))
+
+class _ChannelQueue:
+    """The lock and queued requests of one channel"""
+
+    __slots__ = ('lock', 'tickets', 'latest')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.tickets = []
+
+        # Newest ticket for each request key
+        # Key: request key
+        # Value: Ticket
+        self.latest = {}
+
+class Ticket:
+    """A request's place in its channel's queue; use with `async with`
+
+    Inside the block the request has its channel to itself. If a newer
+    request with the same key was queued meanwhile, stale is True and the
+    request should give up without doing anything.
+    """
+
+    __slots__ = ('scheduler', 'channel_id', 'queue', 'key', 'args', 'started', 'stale')
+
+    def __init__(self, scheduler, channel_id, queue, key, args):
+        self.scheduler = scheduler
+        self.channel_id = channel_id
+        self.queue = queue
+        self.key = key
+        self.args = args
+        self.started = False
+        self.stale = False
+
+    @property
+    def must_wait(self):
+        """Whether other requests are ahead of this one in its channel
+
+        Based on the queue, not the lock: a request that was just handed the
+        lock but has not resumed yet leaves it unlocked for a moment.
+        """
+        return self.queue.tickets[0] is not self
+
+    async def __aenter__(self):
+        try:
+            await self.queue.lock.acquire()
+        except BaseException:
+            self.scheduler._finish(self)
+            raise
+        self.started = True
+        if self.stale:
+            COLLAPSED_REQUESTS.inc('stale')
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.queue.lock.release()
+        self.scheduler._finish(self)
+
+class ChannelScheduler:
+    """Serialises the requests of each channel while channels run in parallel
+
+    Requests carry a key (e.g. the command and user) and arguments.
+    submit() turns away a request that matches one already queued or
+    running, and marks an older waiting request with the same key but
+    different arguments as stale, so only the newest is carried out.
+    """
+
+    def __init__(self):
+        # Key: channel ID
+        # Value: _ChannelQueue, present while the channel has requests
+        self.channels = {}
+
+    def submit(self, channel_id, key, args=None):
+        """Queue a request; returns a Ticket, or None if it duplicates one already queued"""
+        queue = self.channels.get(channel_id)
+        if queue is None:
+            queue = self.channels[channel_id] = _ChannelQueue()
+
+        previous = queue.latest.get(key)
+        if previous is not None and previous.args == args:
+            COLLAPSED_REQUESTS.inc('duplicate')
+            return None
+        if previous is not None and not previous.started:
+            previous.stale = True
+
+        ticket = Ticket(self, channel_id, queue, key, args)
+        queue.tickets.append(ticket)
+        queue.latest[key] = ticket
+        return ticket
+
+    def cancel(self, ticket):
+        """Withdraw a ticket that will not be entered (e.g. its interaction failed)"""
+        if not ticket.started:
+            self._finish(ticket)
+
+    def _finish(self, ticket):
+        queue = ticket.queue
+        queue.tickets.remove(ticket)
+        if queue.latest.get(ticket.key) is ticket:
+            del queue.latest[ticket.key]
+        if not queue.tickets and self.channels.get(ticket.channel_id) is queue:
+            del self.channels[ticket.channel_id]
+
+    def queue_depth(self):
+        """Requests waiting or running across all channels"""
+        return sum(len(queue.tickets) for queue in list(self.channels.values()))
@@ -0,0 +1,732 @@
+import chess
+import chess.polyglot
+import chess.syzygy
+import os
+import random
+import time
+
+from search_board import SearchBoard, PROMOTION_SHIFT, move_to_chess
+from search_cache import get_search_cache, SEARCH_CACHE_VERSION
+
+# Optional Polyglot opening book, consulted before searching
+BOOK_PATH = os.environ.get('AI_BOOK_PATH', 'book.bin')
+
+# Optional Syzygy tablebases: directories (separated like PATH) and how many
+# table files may be open at once (least recently used ones are closed)
+SYZYGY_PATH = os.environ.get('AI_SYZYGY_PATH', '')
+SYZYGY_MAX_FDS = int(os.environ.get('AI_SYZYGY_MAX_FDS', 64))
+
+# Memory cap for each game's transposition table, in megabytes
+TT_SIZE_MB = float(os.environ.get('AI_TT_MB', 8))
+
+# Rough memory cost of one table entry (key, entry tuple and dict slot)
+TT_ENTRY_BYTES = 200
+
+# Bound types stored with transposition table entries
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+
+# How many nodes the search visits between budget and cancellation checks
+CHECK_INTERVAL = 256
+
+# Deepest ply that gets its own killer move slots
+MAX_PLY = 64
+
+# Scores are in centipawns; a checkmate outweighs any material balance
+MATE_SCORE = 100000
+
+# Score of a tablebase win: above any material balance, below a found mate
+TABLEBASE_WIN_SCORE = MATE_SCORE // 2
+
+PIECE_VALUES = {
+    chess.PAWN: 100, chess.KNIGHT: 320, chess.BISHOP: 330,
+    chess.ROOK: 500, chess.QUEEN: 900, chess.KING: 0
+}
+
+# Piece-square bonuses from White's point of view, laid out as the board
+# is drawn (rank 8 first, a-file on the left)
+PIECE_SQUARE_LAYOUTS = {
+    chess.PAWN: [
+         0,  0,  0,  0,  0,  0,  0,  0,
+        50, 50, 50, 50, 50, 50, 50, 50,
+        10, 10, 20, 30, 30, 20, 10, 10,
+         5,  5, 10, 25, 25, 10,  5,  5,
+         0,  0,  0, 20, 20,  0,  0,  0,
+         5, -5,-10,  0,  0,-10, -5,  5,
+         5, 10, 10,-20,-20, 10, 10,  5,
+         0,  0,  0,  0,  0,  0,  0,  0,
+    ],
+    chess.KNIGHT: [
+        -50,-40,-30,-30,-30,-30,-40,-50,
+        -40,-20,  0,  0,  0,  0,-20,-40,
+        -30,  0, 10, 15, 15, 10,  0,-30,
+        -30,  5, 15, 20, 20, 15,  5,-30,
+        -30,  0, 15, 20, 20, 15,  0,-30,
+        -30,  5, 10, 15, 15, 10,  5,-30,
+        -40,-20,  0,  5,  5,  0,-20,-40,
+        -50,-40,-30,-30,-30,-30,-40,-50,
+    ],
+    chess.BISHOP: [
+        -20,-10,-10,-10,-10,-10,-10,-20,
+        -10,  0,  0,  0,  0,  0,  0,-10,
+        -10,  0,  5, 10, 10,  5,  0,-10,
+        -10,  5,  5, 10, 10,  5,  5,-10,
+        -10,  0, 10, 10, 10, 10,  0,-10,
+        -10, 10, 10, 10, 10, 10, 10,-10,
+        -10,  5,  0,  0,  0,  0,  5,-10,
+        -20,-10,-10,-10,-10,-10,-10,-20,
+    ],
+    chess.ROOK: [
+         0,  0,  0,  0,  0,  0,  0,  0,
+         5, 10, 10, 10, 10, 10, 10,  5,
+        -5,  0,  0,  0,  0,  0,  0, -5,
+        -5,  0,  0,  0,  0,  0,  0, -5,
+        -5,  0,  0,  0,  0,  0,  0, -5,
+        -5,  0,  0,  0,  0,  0,  0, -5,
+        -5,  0,  0,  0,  0,  0,  0, -5,
+         0,  0,  0,  5,  5,  0,  0,  0,
+    ],
+    chess.QUEEN: [
+        -20,-10,-10, -5, -5,-10,-10,-20,
+        -10,  0,  0,  0,  0,  0,  0,-10,
+        -10,  0,  5,  5,  5,  5,  0,-10,
+         -5,  0,  5,  5,  5,  5,  0, -5,
+          0,  0,  5,  5,  5,  5,  0, -5,
+        -10,  5,  5,  5,  5,  5,  0,-10,
+        -10,  0,  5,  0,  0,  0,  0,-10,
+        -20,-10,-10, -5, -5,-10,-10,-20,
+    ],
+    chess.KING: [
+        -30,-40,-40,-50,-50,-40,-40,-30,
+        -30,-40,-40,-50,-50,-40,-40,-30,
+        -30,-40,-40,-50,-50,-40,-40,-30,
+        -30,-40,-40,-50,-50,-40,-40,-30,
+        -20,-30,-30,-40,-40,-30,-30,-20,
+        -10,-20,-20,-20,-20,-20,-20,-10,
+         20, 20,  0,  0,  0,  0, 20, 20,
+         20, 30, 10,  0,  0, 10, 30, 20,
+    ],
+}
+
+def _piece_square_table(piece_type, color):
+    """Build a 64-entry table indexed by square for one piece and color"""
+    layout = PIECE_SQUARE_LAYOUTS[piece_type]
+    table = [0] * 64
+    for square in chess.SQUARES:
+        # Row 0 of the layout is rank 8; Black reads the board mirrored
+        white_square = square if color == chess.WHITE else chess.square_mirror(square)
+        row = 7 - chess.square_rank(white_square)
+        table[square] = layout[row * 8 + chess.square_file(white_square)]
+    return table
+
+# PIECE_SQUARE_TABLES[color][piece_type][square]
+PIECE_SQUARE_TABLES = {
+    color: {piece_type: _piece_square_table(piece_type, color) for piece_type in chess.PIECE_TYPES}
+    for color in chess.COLORS
+}
+
+# Signed material plus piece-square value of each piece on each square,
+# indexed [color][piece_type][square]; SearchBoard sums these incrementally
+SCORE_TABLES = [
+    [[0] * 64] + [[sign * (PIECE_VALUES[piece_type] + PIECE_SQUARE_TABLES[color][piece_type][square])
+                   for square in chess.SQUARES]
+                  for piece_type in chess.PIECE_TYPES]
+    for color, sign in ((chess.BLACK, 1), (chess.WHITE, -1))
+]
+
+class SearchCancelled(Exception):
+    """Raised inside the search when its budget runs out or it is cancelled"""
+
+def new_stats(**values):
+    """Statistics for one AI decision; source says how the move was chosen"""
+    stats = {'nodes': 0, 'depth': 0, 'time': 0.0, 'nps': 0, 'score': None, 'source': 'search',
+             'tb_probes': 0, 'tb_hits': 0}
+    stats.update(values)
+    return stats
+
+# Opening book shared by every SimpleAI in the process, opened on first use
+_opening_book = None
+_opening_book_loaded = False
+
+def get_opening_book():
+    """Get the memory-mapped opening book, or None if there is none"""
+    global _opening_book, _opening_book_loaded
+    if not _opening_book_loaded:
+        _opening_book_loaded = True
+        if BOOK_PATH and os.path.exists(BOOK_PATH):
+            try:
+                _opening_book = chess.polyglot.open_reader(BOOK_PATH)
+            except Exception as e:
+                print(f"Error loading opening book: {e}")
+    return _opening_book
+
+# Tablebase shared by every SimpleAI in the process, opened on first use
+_tablebase = None
+_tablebase_pieces = 0
+_tablebase_loaded = False
+
+def get_tablebase():
+    """Get (tablebase, largest piece count it covers), or (None, 0) if there is none"""
+    global _tablebase, _tablebase_pieces, _tablebase_loaded
+    if not _tablebase_loaded:
+        _tablebase_loaded = True
+        directories = [path for path in SYZYGY_PATH.split(os.pathsep) if os.path.isdir(path)]
+        if directories:
+            try:
+                tablebase = chess.syzygy.Tablebase(max_fds=SYZYGY_MAX_FDS)
+                for directory in directories:
+                    tablebase.add_directory(directory)
+                # Table names look like KQvKR: one letter per piece plus the 'v'
+                if tablebase.wdl:
+                    _tablebase = tablebase
+                    _tablebase_pieces = max(len(name) - 1 for name in tablebase.wdl)
+            except Exception as e:
+                print(f"Error loading tablebases: {e}")
+    return _tablebase, _tablebase_pieces
+
+# AI difficulty levels with move selection logic (1-20 scale)
+def get_difficulty_settings(level):
+    """Get AI settings for difficulty level 1-20"""
+    if level < 1 or level > 20:
+        level = 10  # Default to medium
+    
+    # Scale depth from 1-5 based on difficulty
+    depth = min(1 + (level - 1) // 4, 5)
+    
+    # Scale randomness from 0.8 (level 1) to 0.0 (level 20)
+    randomness = max(0.0, 0.8 - (level - 1) * 0.04)
+    
+    # Per-move budget: wall-clock seconds and nodes, whichever runs out first
+    time_limit = 0.5 + level * 0.25
+    node_limit = 20000 * level
+    
+    return {'depth': depth, 'randomness': randomness,
+            'time_limit': time_limit, 'node_limit': node_limit}
+
+class TranspositionTable:
+    """Bounded cache of search results keyed by Zobrist hash
+    
+    Each entry is a (depth, score, bound, best_move, generation) tuple.
+    Within one search a deeper result is never replaced by a shallower one;
+    results left over from earlier searches are always replaced. When the
+    table is full the oldest written entry is evicted.
+    """
+    
+    def __init__(self, size_mb=TT_SIZE_MB):
+        self.capacity = max(1, int(size_mb * 1024 * 1024) // TT_ENTRY_BYTES)
+        self.entries = {}
+        self.generation = 0
+    
+    def new_search(self):
+        """Mark the start of a new search so older entries become replaceable"""
+        self.generation += 1
+    
+    def probe(self, key):
+        """Get the entry stored for a position, or None"""
+        return self.entries.get(key)
+    
+    def store(self, key, depth, score, bound, best_move):
+        """Store a search result, applying the replacement policy"""
+        entries = self.entries
+        old = entries.get(key)
+        if old is not None:
+            if old[4] == self.generation and old[0] > depth:
+                return
+            # Re-insert so the entry counts as freshly written
+            del entries[key]
+        elif len(entries) >= self.capacity:
+            # Dicts keep insertion order, so the first key is the oldest write
+            del entries[next(iter(entries))]
+        entries[key] = (depth, score, bound, best_move, self.generation)
+    
+    def clear(self):
+        """Drop every stored entry"""
+        self.entries.clear()
+
+class SimpleAI:
+    """Simple chess AI that evaluates positions and makes moves"""
+    
+    def __init__(self, difficulty=10, tt_size_mb=TT_SIZE_MB):
+        self.level = difficulty
+        self.difficulty = get_difficulty_settings(difficulty)
+        # Kept across get_best_move calls so later moves of the same game
+        # reuse what earlier searches learned
+        self.tt = TranspositionTable(tt_size_mb)
+        
+        # Move ordering heuristics: two killer moves per ply and a
+        # history score per (from, to) square pair
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.history = [0] * (64 * 64)
+        
+        # Budget and bookkeeping for the search in progress
+        self.nodes = 0
+        self.depth_reached = 0
+        self.stats = new_stats()
+        
+        # (position key, best move, stats) left by the last ponder search
+        self.ponder_result = None
+        
+        # Tablebase probes made inside the search
+        self.tablebase, self.tablebase_pieces = None, 0
+        self.tb_probes = 0
+        self.tb_hits = 0
+        self.deadline = None
+        self.node_limit = None
+        self.cancel_event = None
+    
+    def check_budget(self):
+        """Abort the search if it was cancelled or ran out of time or nodes"""
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise SearchCancelled()
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise SearchCancelled()
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchCancelled()
+    
+    def evaluate_board(self, board):
+        """Material and piece-square evaluation computed from bitboards
+        
+        Returns a score in centipawns: positive for Black advantage, negative
+        for White advantage. Checkmate and stalemate are not detected here;
+        the search already knows when a position has no legal moves. Inside
+        the search, SearchBoard keeps the same score up to date move by move.
+        """
+        score = 0
+        for piece_type in chess.PIECE_TYPES:
+            value = PIECE_VALUES[piece_type]
+            for color, sign in ((chess.BLACK, 1), (chess.WHITE, -1)):
+                mask = board.pieces_mask(piece_type, color)
+                if not mask:
+                    continue
+                
+                total = mask.bit_count() * value
+                table = PIECE_SQUARE_TABLES[color][piece_type]
+                while mask:
+                    lowest = mask & -mask
+                    total += table[lowest.bit_length() - 1]
+                    mask ^= lowest
+                score += sign * total
+        
+        return score
+    
+    def terminal_score(self, board):
+        """Score for a position where the side to move has no legal moves"""
+        if board.is_check():
+            # The side to move is checkmated
+            return MATE_SCORE if board.turn == chess.WHITE else -MATE_SCORE
+        return 0  # Stalemate
+    
+    def probe_wdl(self, board):
+        """Score a SearchBoard from the tablebase's win/draw/loss, or None if it has no table
+        
+        Cursed wins and blessed losses count as draws, since the fifty-move
+        rule saves the losing side.
+        """
+        self.tb_probes += 1
+        try:
+            wdl = self.tablebase.probe_wdl(board.to_board())
+        except KeyError:
+            return None
+        self.tb_hits += 1
+        
+        if wdl == 2:
+            score = TABLEBASE_WIN_SCORE
+        elif wdl == -2:
+            score = -TABLEBASE_WIN_SCORE
+        else:
+            score = 0
+        # wdl is from the side to move's point of view, scores from Black's
+        return score if board.turn == chess.BLACK else -score
+    
+    def tablebase_move(self, board):
+        """Pick the best move by probing the tablebase, or None if it does not cover the position
+        
+        Prefers the best win/draw/loss outcome. Among wins it picks the move
+        that leaves the opponent closest to a forced zeroing move or mate
+        (smallest DTZ); among losses it holds out longest.
+        """
+        tablebase, max_pieces = get_tablebase()
+        if tablebase is None or board.castling_rights or chess.popcount(board.occupied) > max_pieces:
+            return None
+        
+        best_move = None
+        best_rank = None
+        probes = 0
+        try:
+            for move in board.legal_moves:
+                board.push(move)
+                try:
+                    if board.is_checkmate():
+                        rank = (3, 0)
+                    else:
+                        # Both probes are from the opponent's point of view
+                        wdl = -tablebase.probe_wdl(board)
+                        dtz = abs(tablebase.probe_dtz(board))
+                        probes += 2
+                        rank = (wdl, -dtz if wdl > 0 else dtz)
+                finally:
+                    board.pop()
+                if best_rank is None or rank > best_rank:
+                    best_move, best_rank = move, rank
+        except KeyError:
+            return None
+        
+        self.stats = new_stats(source='tablebase', tb_probes=probes, tb_hits=probes)
+        return best_move
+    
+    def order_moves(self, board, moves, hash_move, ply):
+        """Sort moves so the ones most likely to cause a cutoff come first
+        
+        Order: hash move, captures by MVV-LVA (most valuable victim, least
+        valuable attacker), promotions, killer moves for this ply, then the
+        remaining quiet moves by history score.
+        """
+        first_killer, second_killer = self.killers[ply] if ply < MAX_PLY else (None, None)
+        history = self.history
+        squares = board.squares
+        ep_square = board.ep_square
+        
+        def move_score(move):
+            if move == hash_move:
+                return 1000000
+            to_square = (move >> 6) & 63
+            victim = squares[to_square]
+            attacker = squares[move & 63]
+            if not victim and attacker == chess.PAWN and to_square == ep_square:
+                victim = chess.PAWN
+            if victim:
+                return 100000 + victim * 10 - attacker
+            if move >> PROMOTION_SHIFT:
+                return 90000 + (move >> PROMOTION_SHIFT)
+            if move == first_killer or move == second_killer:
+                return 80000
+            return history[move & 4095]
+        
+        moves.sort(key=move_score, reverse=True)
+        return moves
+    
+    def record_cutoff(self, board, move, depth, ply):
+        """Remember a quiet move that caused a beta cutoff"""
+        if board.squares[(move >> 6) & 63] or move >> PROMOTION_SHIFT:
+            return
+        if ply < MAX_PLY:
+            killers = self.killers[ply]
+            if killers[0] != move:
+                killers[1] = killers[0]
+                killers[0] = move
+        self.history[move & 4095] += depth * depth
+    
+    def minimax(self, board, depth, alpha, beta, maximizing, ply=1):
+        """Minimax algorithm with alpha-beta pruning and a transposition table
+        
+        board is a SearchBoard; its incrementally updated score serves as the
+        evaluation at the leaves.
+        """
+        self.nodes += 1
+        if self.nodes % CHECK_INTERVAL == 0:
+            self.check_budget()
+        
+        # Draws by rule need no search
+        if board.halfmove_clock >= 100 or board.is_repetition() or board.is_insufficient_material():
+            return 0
+        
+        # With few enough pieces left the tablebase knows the exact outcome
+        if (self.tablebase is not None and not board.castling and
+                board.piece_count() <= self.tablebase_pieces):
+            score = self.probe_wdl(board)
+            if score is not None:
+                return score
+        
+        # Only a side in check can be mated, so only then look for a reply
+        if depth == 0:
+            if board.is_check() and not board.has_legal_move():
+                return self.terminal_score(board)
+            return board.score
+        
+        key = board.key
+        alpha_orig, beta_orig = alpha, beta
+        
+        # Reuse an earlier result for this position if it was searched deep enough
+        hash_move = None
+        entry = self.tt.probe(key)
+        if entry is not None:
+            entry_depth, entry_score, entry_bound, hash_move = entry[:4]
+            if entry_depth >= depth:
+                if entry_bound == EXACT:
+                    return entry_score
+                if entry_bound == LOWER_BOUND:
+                    alpha = max(alpha, entry_score)
+                else:
+                    beta = min(beta, entry_score)
+                if beta <= alpha:
+                    return entry_score
+        
+        moves = self.order_moves(board, board.generate_moves(), hash_move, ply)
+        
+        # Moves are pseudo-legal; make() rejects the ones that leave the king in check
+        best_move = None
+        if maximizing:
+            best_score = -float('inf')
+            for move in moves:
+                if not board.make(move):
+                    continue
+                eval_score = self.minimax(board, depth - 1, alpha, beta, False, ply + 1)
+                board.unmake()
+                if eval_score > best_score:
+                    best_score, best_move = eval_score, move
+                alpha = max(alpha, eval_score)
+                if beta <= alpha:
+                    self.record_cutoff(board, move, depth, ply)
+                    break
+        else:
+            best_score = float('inf')
+            for move in moves:
+                if not board.make(move):
+                    continue
+                eval_score = self.minimax(board, depth - 1, alpha, beta, True, ply + 1)
+                board.unmake()
+                if eval_score < best_score:
+                    best_score, best_move = eval_score, move
+                beta = min(beta, eval_score)
+                if beta <= alpha:
+                    self.record_cutoff(board, move, depth, ply)
+                    break
+        
+        if best_move is None:
+            return self.terminal_score(board)
+        
+        # Record whether the score is exact or only a bound on the true value
+        if best_score <= alpha_orig:
+            bound = UPPER_BOUND
+        elif best_score >= beta_orig:
+            bound = LOWER_BOUND
+        else:
+            bound = EXACT
+        self.tt.store(key, depth, best_score, bound, best_move)
+        return best_score
+    
+    def search_root(self, board, legal_moves, depth):
+        """Search every root move to the given depth and return the best one
+        
+        The root carries alpha-beta bounds like every other node, so once a
+        good move is found the rest only have to be proven worse.
+        """
+        # Scores are from Black's point of view, so Black maximizes
+        maximizing = board.turn == chess.BLACK
+        alpha, beta = -float('inf'), float('inf')
+        best_move = None
+        best_value = -float('inf') if maximizing else float('inf')
+        
+        # A cancelled search leaves the board mid-tree; it is thrown away then
+        for move in legal_moves:
+            board.make(move)
+            move_value = self.minimax(board, depth, alpha, beta, not maximizing)
+            board.unmake()
+            
+            if maximizing and move_value > best_value:
+                best_value, best_move = move_value, move
+                alpha = move_value
+            elif not maximizing and move_value < best_value:
+                best_value, best_move = move_value, move
+                beta = move_value
+        
+        # The root is searched one ply deeper than its children
+        self.tt.store(board.key, depth + 1, best_value, EXACT, best_move)
+        return best_move, best_value
+    
+    def get_best_move(self, board, time_limit=None, node_limit=None, cancel_event=None):
+        """Get the best move for the side to move
+        
+        Searches with iterative deepening up to the difficulty's depth and
+        returns the best move of the deepest iteration that completed within
+        the time and node budget. The budget defaults to the difficulty's
+        settings. cancel_event can be any object with an is_set() method
+        (e.g. threading.Event); setting it stops the search early.
+        Statistics for the decision are left in self.stats.
+        """
+        self.stats = new_stats()
+        
+        # Known openings need no search at all
+        book_move = self.book_move(board)
+        if book_move is not None:
+            self.stats = new_stats(source='book')
+            return book_move
+        
+        # The search runs on a compact copy of the position
+        search_board = SearchBoard(board, SCORE_TABLES)
+        legal_moves = search_board.legal_moves()
+        if not legal_moves:
+            return None
+        
+        # Add randomness based on difficulty
+        if random.random() < self.difficulty['randomness']:
+            self.stats = new_stats(source='random')
+            return move_to_chess(random.choice(legal_moves))
+        
+        # Endgames covered by the tablebase are played exactly and instantly
+        tablebase_move = self.tablebase_move(board)
+        if tablebase_move is not None:
+            return tablebase_move
+        
+        # Answer at once if pondering already searched this position fully
+        ponder_result, self.ponder_result = self.ponder_result, None
+        if ponder_result is not None:
+            ponder_key, ponder_move, ponder_stats = ponder_result
+            if ponder_key == search_board.key and ponder_stats['depth'] >= self.difficulty['depth']:
+                self.stats = dict(ponder_stats, source='ponder')
+                return move_to_chess(ponder_move)
+        
+        # Reuse an earlier search of this position by any game, in any process
+        cache = get_search_cache()
+        key = search_board.key
+        settings = self.cache_settings()
+        if cache is not None:
+            cached = cache.get(key, settings, self.difficulty['depth'])
+            # Guard against a Zobrist collision handing back a foreign move
+            if cached is not None and cached[1] in legal_moves and self.cache_safe(search_board, cached[0]):
+                depth, cached_move, score, nodes = cached
+                self.stats = new_stats(depth=depth, score=score, source='cache')
+                return move_to_chess(cached_move)
+        
+        best_move = self.search(search_board, legal_moves, time_limit, node_limit, cancel_event)
+        if cache is not None and self.depth_reached and self.cache_safe(SearchBoard(board), self.depth_reached):
+            cache.put(key, settings, self.depth_reached, best_move, self.stats['score'], self.stats['nodes'])
+        return move_to_chess(best_move)
+    
+    def cache_safe(self, search_board, depth):
+        """Whether a search of a position to depth cannot depend on how the game got there
+        
+        The search scores the fifty-move rule and repetitions of earlier
+        positions as draws, but the shared search cache only knows the
+        position. Its results are only shared where neither can come into
+        play: the nodes of a depth-d search reach ply d + 1, and
+        SearchBoard.is_repetition compares a node with positions at least
+        four plies before it.
+        """
+        reach = depth + 1
+        if search_board.halfmove_clock + reach >= 100:
+            return False
+        return not search_board.history_length or search_board.history_length + reach < 4
+    
+    def cache_settings(self):
+        """The search settings that change a search's result, for the shared search cache
+        
+        The difficulty's time and node budget only decide how deep a search
+        gets, and the depth is part of the cache key anyway. What does change
+        the result of a completed depth is the search code itself and which
+        tablebases it probes.
+        """
+        return f"{SEARCH_CACHE_VERSION}:{get_tablebase()[1]}"
+    
+    def book_move(self, board):
+        """Pick a move from the opening book, or None if the position is not in it
+        
+        Entries are chosen at random in proportion to weight ** (level / 10):
+        low levels pick almost uniformly among book moves and so vary their
+        openings, while high levels stick to the main lines.
+        """
+        book = get_opening_book()
+        if book is None:
+            return None
+        
+        entries = list(book.find_all(board))
+        if not entries:
+            return None
+        
+        sharpness = self.level / 10
+        weights = [entry.weight ** sharpness for entry in entries]
+        return random.choices(entries, weights=weights)[0].move
+    
+    def search(self, search_board, legal_moves, time_limit=None, node_limit=None, cancel_event=None):
+        """Iterative deepening search of a SearchBoard's legal moves
+        
+        Returns the best move (as an int) of the deepest completed iteration.
+        """
+        start = time.monotonic()
+        self.nodes = 0
+        self.depth_reached = 0
+        
+        if time_limit is None:
+            time_limit = self.difficulty['time_limit']
+        if node_limit is None:
+            node_limit = self.difficulty['node_limit']
+        
+        self.tablebase, self.tablebase_pieces = get_tablebase()
+        self.tb_probes = 0
+        self.tb_hits = 0
+        
+        self.tt.new_search()
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        # Age the history so old cutoffs fade as the game moves on
+        self.history = [score // 2 for score in self.history]
+        self.deadline = start + time_limit
+        self.node_limit = node_limit
+        self.cancel_event = cancel_event
+        
+        entry = self.tt.probe(search_board.key)
+        legal_moves = self.order_moves(search_board, legal_moves, entry[3] if entry else None, 0)
+        
+        best_move = None
+        best_value = None
+        try:
+            for depth in range(1, self.difficulty['depth'] + 1):
+                best_move, best_value = self.search_root(search_board, legal_moves, depth)
+                self.depth_reached = depth
+                
+                # Search the previous iteration's best move first next time
+                legal_moves.remove(best_move)
+                legal_moves.insert(0, best_move)
+        except SearchCancelled:
+            pass
+        finally:
+            self.deadline = None
+            self.node_limit = None
+            self.cancel_event = None
+        
+        elapsed = time.monotonic() - start
+        self.stats = new_stats(
+            nodes=self.nodes,
+            depth=self.depth_reached,
+            time=elapsed,
+            nps=int(self.nodes / elapsed) if elapsed > 0 else 0,
+            score=best_value,
+            tb_probes=self.tb_probes,
+            tb_hits=self.tb_hits,
+        )
+        
+        return best_move if best_move is not None else random.choice(legal_moves)
+    
+    def predict_reply(self, board):
+        """Guess the opponent's reply from the transposition table, or None"""
+        entry = self.tt.probe(SearchBoard(board).key)
+        if entry is None or entry[3] is None:
+            return None
+        move = move_to_chess(entry[3])
+        # Guard against a Zobrist collision handing back a foreign move
+        return move if board.is_legal(move) else None
+    
+    def ponder(self, board, time_limit=None, node_limit=None, cancel_event=None):
+        """Search ahead during the opponent's turn
+        
+        Predicts the opponent's reply and searches the position after it,
+        warming the transposition table. If the opponent then plays the
+        predicted move, get_best_move can answer from the ponder result
+        without searching again. Returns the predicted move, or None when
+        there is nothing to ponder.
+        """
+        predicted = self.predict_reply(board)
+        if predicted is None:
+            return None
+        
+        board = board.copy()
+        board.push(predicted)
+        search_board = SearchBoard(board, SCORE_TABLES)
+        legal_moves = search_board.legal_moves()
+        if not legal_moves:
+            return None
+        
+        key = search_board.key
+        best_move = self.search(search_board, legal_moves, time_limit, node_limit, cancel_event)
+        self.ponder_result = (key, best_move, self.stats)
+        return predicted
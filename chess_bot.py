@@ -1,301 +1,214 @@
 from keep_alive import keep_alive
 import os
 import discord
-from discord.ext import commands
+from discord import app_commands
+from discord.ext import commands, tasks
 import chess
+import chess.pgn
 import chess.svg
 import asyncio
-import random
 import io
-from PIL import Image, ImageDraw, ImageFont
-import tempfile
+import time
+import hashlib
 import json
+import collections
+import metrics
+from ai_pool import AIPool
+from analysis import (Analyzer, draw_eval_graph, find_mistakes, ANALYSIS_DEPTH,
+                      ANALYSIS_PROGRESS_INTERVAL, MAX_PGN_BYTES)
+from board_renderer import BoardRenderer
+from channel_scheduler import ChannelScheduler, QUEUED_REQUESTS
+from loop_watchdog import LoopWatchdog
+from outbound import GameMessages
+from game_store import GameStore
+from sqlite_store import SQLiteGameStore
+from game_registry import GameRegistry, GameState, GAME_EVICT_INTERVAL
+
+# Startup is timed from here to the first on_ready
+PROCESS_STARTED = time.perf_counter()
+time_to_ready = None
+
+# Hash of the slash commands as last synced; they are only synced again when it changes
+COMMAND_HASH_PATH = os.environ.get('COMMAND_HASH_PATH', 'commands.sha256')
 
 # Bot setup with proper intents
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
-bot = commands.Bot(command_prefix='/', intents=intents)
 
-# Dictionary to store active games
+class InstrumentedTree(app_commands.CommandTree):
+    """Command tree that times every slash command for /metrics"""
+    
+    async def interaction_check(self, interaction):
+        interaction.extras['started'] = time.perf_counter()
+        if interaction.command is not None:
+            watchdog.tag(interaction.channel_id, interaction.command.name)
+        return True
+    
+    async def on_error(self, interaction, error):
+        observe_command(interaction, 'error')
+        await super().on_error(interaction, error)
+
+def observe_command(interaction, status):
+    """Record how long a slash command took"""
+    started = interaction.extras.get('started')
+    if started is not None and interaction.command is not None:
+        metrics.COMMAND_SECONDS.observe(time.perf_counter() - started, interaction.command.name, status)
+
+# Sharded mode (see sharding.py): this process runs only SHARD_IDS out of SHARD_COUNT shards
+SHARD_COUNT = int(os.environ.get('SHARD_COUNT', 0))
+SHARD_IDS = [int(shard_id) for shard_id in os.environ['SHARD_IDS'].split(',')] if os.environ.get('SHARD_IDS') else None
+
+if SHARD_COUNT:
+    bot = commands.AutoShardedBot(command_prefix='/', intents=intents, tree_cls=InstrumentedTree,
+                                  shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+else:
+    bot = commands.Bot(command_prefix='/', intents=intents, tree_cls=InstrumentedTree)
+
+# Logs (and reports to /health) whatever blocks the event loop
+watchdog = LoopWatchdog()
+
+# Runs each channel's commands one at a time
+channel_scheduler = ChannelScheduler()
+
+# Worker processes that run AI searches off the event loop
+ai_pool = AIPool()
+
+# Game changes, written from a background thread: to a journal file, or
+# to the SQLite database that all shard processes share
+if SHARD_COUNT or os.environ.get('GAME_STORE') == 'sqlite':
+    game_store = SQLiteGameStore(shard_ids=SHARD_IDS, shard_count=SHARD_COUNT)
+else:
+    game_store = GameStore()
+
+# Cached, sprite-based board images, rendered on a thread pool and
+# redrawn incrementally from each channel's previous frame
+board_renderer = BoardRenderer()
+
+# One message per channel showing its game, edited in place with rapid
+# updates coalesced and sends paced to stay under Discord's rate limits
+game_messages = GameMessages()
+
+# Evaluates whole games for /analyze on its own worker processes
+analyzer = Analyzer()
+
+# Users whose /analyze is running
+running_analyses = set()
+
+# Most recently finished games, for /analyze
 # Key: channel ID
-# Value: dictionary with 'board', 'players', 'type', 'difficulty'
-active_games = {}
+# Value: chess.Board holding the game's moves
+finished_games = collections.OrderedDict()
+FINISHED_GAMES_KEPT = 256
 
-# AI difficulty levels with move selection logic (1-20 scale)
-def get_difficulty_settings(level):
-    """Get AI settings for difficulty level 1-20"""
-    if level < 1 or level > 20:
-        level = 10  # Default to medium
-    
-    # Scale depth from 1-5 based on difficulty
-    depth = min(1 + (level - 1) // 4, 5)
-    
-    # Scale randomness from 0.8 (level 1) to 0.0 (level 20)
-    randomness = max(0.0, 0.8 - (level - 1) * 0.04)
-    
-    return {'depth': depth, 'randomness': randomness}
+# Active games by channel ID (GameState); idle games' boards are dropped
+# and rebuilt from the store's compact copy on their next use
+active_games = GameRegistry(game_store)
 
-def save_games():
-    """Save all active games to JSON file"""
-    try:
-        games_data = {}
-        for channel_id, game_state in active_games.items():
-            # Convert board to FEN string for saving
-            games_data[str(channel_id)] = {
-                'board_fen': game_state['board'].fen(),
-                'players': game_state['players'],
-                'type': game_state['type'],
-                'difficulty': game_state.get('difficulty')
-            }
-        
-        with open('saved_games.json', 'w') as f:
-            json.dump(games_data, f, indent=2)
-    except Exception as e:
-        print(f"Error saving games: {e}")
+metrics.ACTIVE_GAMES.callback = game_store.count_by_type
+metrics.RESIDENT_GAMES.callback = lambda: len(active_games.resident)
+QUEUED_REQUESTS.callback = channel_scheduler.queue_depth
+
+def push_move(channel_id, board, move):
+    """Play a move and journal it"""
+    game_store.record_move(channel_id, move.uci(), len(board.move_stack))
+    board.push(move)
+
+def pop_move(channel_id, board):
+    """Take back the last move and journal it"""
+    board.pop()
+    game_store.record_undo(channel_id, len(board.move_stack))
+
+def remember_finished_game(channel_id, board):
+    """Keep a channel's finished game around so /analyze can review it"""
+    finished_games.pop(channel_id, None)
+    finished_games[channel_id] = board.copy()
+    while len(finished_games) > FINISHED_GAMES_KEPT:
+        finished_games.popitem(last=False)
 
 def load_games():
-    """Load active games from JSON file"""
-    global active_games
+    """Load active games from the snapshot and journal; each game is built on first use"""
     try:
-        if os.path.exists('saved_games.json'):
-            with open('saved_games.json', 'r') as f:
-                games_data = json.load(f)
-            
-            for channel_id_str, game_data in games_data.items():
-                channel_id = int(channel_id_str)
-                
-                # Reconstruct board from FEN
-                board = chess.Board(game_data['board_fen'])
-                
-                # Reconstruct game state
-                game_state = {
-                    'board': board,
-                    'players': tuple(game_data['players']),
-                    'type': game_data['type']
-                }
-                
-                # Add AI and difficulty for AI games
-                if game_data['type'] == 'ai' and game_data.get('difficulty'):
-                    game_state['difficulty'] = game_data['difficulty']
-                    game_state['ai'] = SimpleAI(game_data['difficulty'])
-                
-                active_games[channel_id] = game_state
-            
-            print(f"Loaded {len(active_games)} saved games")
+        game_store.start(game_store.load())
+        print(f"Loaded {len(active_games)} saved games")
     except Exception as e:
         print(f"Error loading games: {e}")
-        active_games = {}
-
-def generate_chess_board_image(board, difficulty=None):
-    """Generate a PNG image of the chess board using PIL"""
-    # Board dimensions
-    square_size = 50
-    label_size = 20
-    title_height = 30 if difficulty else 0
-    board_size = square_size * 8
-    total_width = board_size + label_size * 2
-    total_height = board_size + label_size * 2 + title_height
-    
-    # Create image with space for labels and title
-    img = Image.new('RGB', (total_width, total_height), color='white')
-    draw = ImageDraw.Draw(img)
-    
-    # Draw title with difficulty if AI game
-    if difficulty:
-        try:
-            title_font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 20)
-        except:
-            title_font = ImageFont.load_default()
-        
-        title_text = f"AI Difficulty: {difficulty}"
-        draw.text((total_width // 2, title_height // 2), title_text, fill='black', 
-                 font=title_font, anchor='mm')
-    
-    # Colors
-    light_square = '#F0D9B5'
-    dark_square = '#B58863'
-    
-    # Board offset for labels and title
-    board_x_offset = label_size
-    board_y_offset = label_size + title_height
-    
-    # Draw board squares
-    for rank in range(8):
-        for file in range(8):
-            x1 = board_x_offset + file * square_size
-            y1 = board_y_offset + rank * square_size
-            x2 = x1 + square_size
-            y2 = y1 + square_size
-            
-            # Determine square color
-            is_light = (rank + file) % 2 == 0
-            color = light_square if is_light else dark_square
-            
-            draw.rectangle([x1, y1, x2, y2], fill=color)
-    
-    # Draw rank and file labels
-    try:
-        label_font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 12)
-    except:
-        label_font = ImageFont.load_default()
-    
-    # Files (a-h) at bottom and top
-    for file in range(8):
-        file_letter = chr(ord('a') + file)
-        x = board_x_offset + file * square_size + square_size // 2
-        
-        # Bottom labels
-        draw.text((x, board_y_offset + board_size + label_size // 2), file_letter, 
-                 fill='black', font=label_font, anchor='mm')
-        # Top labels
-        draw.text((x, board_y_offset - label_size // 2), file_letter, 
-                 fill='black', font=label_font, anchor='mm')
-    
-    # Ranks (1-8) at left and right
-    for rank in range(8):
-        rank_number = str(8 - rank)  # Flip for display (8 at top, 1 at bottom)
-        y = board_y_offset + rank * square_size + square_size // 2
-        
-        # Left labels
-        draw.text((label_size // 2, y), rank_number, 
-                 fill='black', font=label_font, anchor='mm')
-        # Right labels
-        draw.text((board_x_offset + board_size + label_size // 2, y), rank_number, 
-                 fill='black', font=label_font, anchor='mm')
-    
-    # Unicode chess pieces (for drawing text)
-    piece_symbols = {
-        'P': '♙', 'R': '♖', 'N': '♘', 'B': '♗', 'Q': '♕', 'K': '♔',  # White
-        'p': '♟', 'r': '♜', 'n': '♞', 'b': '♝', 'q': '♛', 'k': '♚'   # Black
-    }
-    
-    # Draw pieces
-    try:
-        # Try to use a larger font
-        font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 30)
-    except:
-        # Fallback to default font
-        font = ImageFont.load_default()
-    
-    for rank in range(8):
-        for file in range(8):
-            square = chess.square(file, 7-rank)  # Flip rank for display
-            piece = board.piece_at(square)
-            
-            if piece:
-                piece_char = piece_symbols.get(piece.symbol(), piece.symbol())
-                
-                # Calculate text position (centered in square, accounting for offsets)
-                x = board_x_offset + file * square_size + square_size // 2
-                y = board_y_offset + rank * square_size + square_size // 2
-                
-                # Draw piece
-                draw.text((x, y), piece_char, fill='black', font=font, anchor='mm')
-    
-    # Convert to BytesIO for Discord
-    buffer = io.BytesIO()
-    img.save(buffer, format='PNG')
-    buffer.seek(0)
-    
-    return buffer
-
-class SimpleAI:
-    """Simple chess AI that evaluates positions and makes moves"""
-    
-    def __init__(self, difficulty=10):
-        self.difficulty = get_difficulty_settings(difficulty)
-    
-    def evaluate_board(self, board):
-        """Simple board evaluation function"""
-        if board.is_checkmate():
-            # If it's checkmate, the side to move has lost
-            # Return positive score for Black advantage, negative for White advantage
-            return 9999 if board.turn == chess.WHITE else -9999
-        if board.is_stalemate():
-            return 0
-        
-        piece_values = {
-            chess.PAWN: 1, chess.KNIGHT: 3, chess.BISHOP: 3,
-            chess.ROOK: 5, chess.QUEEN: 9, chess.KING: 0
-        }
-        
-        score = 0
-        for square in chess.SQUARES:
-            piece = board.piece_at(square)
-            if piece:
-                value = piece_values[piece.piece_type]
-                score += value if piece.color == chess.BLACK else -value
-        
-        return score
-    
-    def minimax(self, board, depth, alpha, beta, maximizing):
-        """Minimax algorithm with alpha-beta pruning"""
-        if depth == 0 or board.is_game_over():
-            return self.evaluate_board(board)
-        
-        if maximizing:
-            max_eval = -float('inf')
-            for move in board.legal_moves:
-                board.push(move)
-                eval_score = self.minimax(board, depth - 1, alpha, beta, False)
-                board.pop()
-                max_eval = max(max_eval, eval_score)
-                alpha = max(alpha, eval_score)
-                if beta <= alpha:
-                    break
-            return max_eval
-        else:
-            min_eval = float('inf')
-            for move in board.legal_moves:
-                board.push(move)
-                eval_score = self.minimax(board, depth - 1, alpha, beta, True)
-                board.pop()
-                min_eval = min(min_eval, eval_score)
-                beta = min(beta, eval_score)
-                if beta <= alpha:
-                    break
-            return min_eval
-    
-    def get_best_move(self, board):
-        """Get the best move for the AI"""
-        legal_moves = list(board.legal_moves)
-        if not legal_moves:
-            return None
-        
-        # Add randomness based on difficulty
-        if random.random() < self.difficulty['randomness']:
-            return random.choice(legal_moves)
-        
-        best_move = None
-        best_value = -float('inf')
-        
-        for move in legal_moves:
-            board.push(move)
-            move_value = self.minimax(board, self.difficulty['depth'], -float('inf'), float('inf'), False)
-            board.pop()
-            
-            if move_value > best_value:
-                best_value = move_value
-                best_move = move
-        
-        return best_move if best_move else random.choice(legal_moves)
+        game_store.start({})
+
+@tasks.loop(seconds=GAME_EVICT_INTERVAL)
+async def evict_idle_games():
+    """Drop games nobody has touched for a while from memory"""
+    evicted = active_games.evict_idle()
+    if evicted:
+        print(f"Evicted {evicted} idle games")
 
 @bot.event
-async def on_ready():
-    """Bot startup event"""
-    print(f'Logged in as {bot.user.name} ({bot.user.id})')
-    print('------')
-    
-    # Load saved games
-    load_games()
+async def on_app_command_completion(interaction, command):
+    """Record the latency of every successful slash command"""
+    observe_command(interaction, 'ok')
+
+def command_tree_hash():
+    """Hash of the slash command definitions that would be synced"""
+    commands_data = sorted((command.to_dict(bot.tree) for command in bot.tree.get_commands()),
+                           key=lambda command: command['name'])
+    data = json.dumps([bot.application_id, commands_data], sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+async def sync_commands():
+    """Sync the slash commands, unless they are unchanged since the last sync"""
+    tree_hash = command_tree_hash()
+    try:
+        with open(COMMAND_HASH_PATH, 'r') as f:
+            if f.read().strip() == tree_hash:
+                print('Slash commands unchanged; skipping sync')
+                return
+    except OSError:
+        pass
     
     try:
         synced = await bot.tree.sync()
         print(f'Synced {len(synced)} slash command(s)')
+        with open(COMMAND_HASH_PATH, 'w') as f:
+            f.write(tree_hash)
     except Exception as e:
         print(f'Failed to sync commands: {e}')
 
+async def setup_hook():
+    """Runs once, after logging in and before connecting to the gateway
+    
+    Everything here used to run in on_ready, which fires again on every
+    reconnect: games were reloaded over the live ones and the commands
+    re-synced each time.
+    """
+    watchdog.start(asyncio.get_running_loop())
+    
+    # Load saved games
+    phase_started = time.perf_counter()
+    load_games()
+    metrics.STARTUP_SECONDS.set(time.perf_counter() - phase_started, 'load')
+    evict_idle_games.start()
+    
+    # Commands are global, so one process syncing them is enough
+    if SHARD_IDS is None or 0 in SHARD_IDS:
+        phase_started = time.perf_counter()
+        await sync_commands()
+        metrics.STARTUP_SECONDS.set(time.perf_counter() - phase_started, 'sync')
+
+bot.setup_hook = setup_hook
+
+@bot.event
+async def on_ready():
+    """Bot startup event; also fires after every reconnect"""
+    global time_to_ready
+    if time_to_ready is not None:
+        print(f'Reconnected as {bot.user.name} ({bot.user.id})')
+        return
+    
+    time_to_ready = time.perf_counter() - PROCESS_STARTED
+    metrics.STARTUP_SECONDS.set(time_to_ready, 'ready')
+    print(f'Logged in as {bot.user.name} ({bot.user.id}); ready in {time_to_ready:.2f}s')
+    print('------')
+
 @bot.tree.command(name="chess", description="Start a new chess game against AI or another player")
 async def start_chess_game(
     interaction: discord.Interaction,
@@ -303,11 +216,16 @@ async def start_chess_game(
     difficulty: int = None
 ):
     """Start a new chess game"""
+    await run_in_channel(interaction, ('chess', interaction.user.id), (opponent and opponent.id, difficulty),
+                         start_game, opponent, difficulty)
+
+async def start_game(interaction, opponent, difficulty):
+    """Start a new chess game, with the channel to ourselves"""
     channel_id = interaction.channel.id
     player1 = interaction.user
     
     if channel_id in active_games:
-        await interaction.response.send_message(
+        await send_response(interaction,
             "A game is already in progress in this channel. Use `/move` to play or `/end` to stop the current game.",
             ephemeral=True
         )
@@ -318,68 +236,75 @@ async def start_chess_game(
     if opponent:
         # PvP Game
         if player1.id == opponent.id:
-            await interaction.response.send_message("You can't play against yourself!", ephemeral=True)
+            await send_response(interaction, "You can't play against yourself!", ephemeral=True)
             return
         
-        active_games[channel_id] = {
-            'board': board,
-            'players': (player1.id, opponent.id),  # White, Black
-            'type': 'pvp'
-        }
-        save_games()  # Save after creating new game
+        active_games[channel_id] = GameState((player1.id, opponent.id), 'pvp', board=board)  # White, Black
+        game_store.record_start(channel_id, board, (player1.id, opponent.id), 'pvp', guild_id=interaction.guild_id)
         
         embed = discord.Embed(
             title="♟️ Chess Game Started!",
             description=f"**{player1.mention}** (White) vs **{opponent.mention}** (Black)\n\nIt's **{player1.mention}'s** turn!",
             color=0x8B4513
         )
-        embed.add_field(name="Board", value=f"```\n{board.unicode()}\n```", inline=False)
+        await post_board(interaction, embed, board)
         
-        await interaction.response.send_message(embed=embed)
+        await send_response(interaction, "Game started! The board below is updated as you play.", ephemeral=True)
         
     else:
         # AI Game
         if not difficulty or difficulty < 1 or difficulty > 20:
-            await interaction.response.send_message(
+            await send_response(interaction,
                 "Please select a difficulty level from 1 to 20 (1 = easiest, 20 = hardest)",
                 ephemeral=True
             )
             return
         
-        active_games[channel_id] = {
-            'board': board,
-            'players': (player1.id, None),  # White (player), Black (AI)
-            'type': 'ai',
-            'difficulty': difficulty,
-            'ai': SimpleAI(difficulty)
-        }
-        save_games()  # Save after creating new game
+        active_games[channel_id] = GameState((player1.id, None), 'ai', difficulty, board=board)  # White (player), Black (AI)
+        game_store.record_start(channel_id, board, (player1.id, None), 'ai', difficulty, interaction.guild_id)
         
         embed = discord.Embed(
             title="♟️ Chess vs AI Started!",
             description=f"**{player1.mention}** vs AI (Difficulty: **{difficulty}**)\n\nYou are White - make your move!",
             color=0x8B4513
         )
-        embed.add_field(name="Board", value=f"```\n{board.unicode()}\n```", inline=False)
         embed.add_field(name="How to move", value="Use `/move e2e4` format", inline=False)
+        await post_board(interaction, embed, board, difficulty)
         
-        await interaction.response.send_message(embed=embed)
+        await send_response(interaction, "Game started! The board below is updated as you play.", ephemeral=True)
 
 @bot.tree.command(name="move", description="Make a move in the current chess game")
 async def make_move(interaction: discord.Interaction, move: str):
     """Make a move in the chess game"""
+    await run_in_channel(interaction, ('move', interaction.user.id), move.strip(), play_move, move)
+
+async def play_move(interaction, move):
+    """Make a move in the chess game, with the channel to ourselves"""
     channel_id = interaction.channel.id
     
     if channel_id not in active_games:
-        await interaction.response.send_message(
+        await send_response(interaction,
             "No game is currently in progress. Use `/chess` to start one.",
             ephemeral=True
         )
         return
     
     game_state = active_games[channel_id]
-    board = game_state['board']
-    game_type = game_state['type']
+    board = game_state.board
+    game_type = game_state.type
+    
+    if game_type == 'ai' and board.turn == chess.BLACK:
+        # The AI never replied to the last move (e.g. the bot restarted
+        # mid-search), so reply now instead of playing the input for Black
+        if interaction.user.id != game_state.players[0]:
+            await send_response(interaction, "You are not in the current game.", ephemeral=True)
+            return
+        if ai_pool.overloaded():
+            await send_response(interaction, "The AI is very busy right now. Please try your move again in a moment.",
+                                ephemeral=True)
+            return
+        await play_ai_reply(interaction, game_state, board.peek().uci() if board.move_stack else None)
+        return
     
     # Parse the move - support both UCI (e2e4) and SAN (e4, Nf3, O-O) notation
     try:
@@ -390,14 +315,14 @@ async def make_move(interaction: discord.Interaction, move: str):
             # If SAN fails, try UCI notation (e2e4, g1f3, etc.)
             user_move = board.parse_uci(move)
         except ValueError:
-            await interaction.response.send_message(
+            await send_response(interaction,
                 f"Invalid move format: `{move}`. Please use standard notation like `e4`, `Nf3`, `O-O` or UCI format like `e2e4`.",
                 ephemeral=True
             )
             return
     
     if user_move not in board.legal_moves:
-        await interaction.response.send_message(
+        await send_response(interaction,
             f"Invalid move: `{move}`. That is not a legal move.",
             ephemeral=True
         )
@@ -405,15 +330,14 @@ async def make_move(interaction: discord.Interaction, move: str):
     
     if game_type == 'pvp':
         # PvP logic
-        players = game_state['players']
+        players = game_state.players
         current_turn_player_id = players[0] if board.turn == chess.WHITE else players[1]
         
         if interaction.user.id != current_turn_player_id:
-            await interaction.response.send_message("It's not your turn!", ephemeral=True)
+            await send_response(interaction, "It's not your turn!", ephemeral=True)
             return
         
-        board.push(user_move)
-        save_games()  # Save after move
+        push_move(channel_id, board, user_move)
         
         if board.is_game_over():
             await handle_game_over(interaction, board, move, board.result(), players, game_type)
@@ -428,45 +352,145 @@ async def make_move(interaction: discord.Interaction, move: str):
             description=f"**{interaction.user.mention}** played: `{move}`\n\nIt's **{next_player_mention}'s** turn!",
             color=0x8B4513
         )
-        embed.add_field(name="Board", value=f"```\n{board.unicode()}\n```", inline=False)
+        await post_board(interaction, embed, board)
         
-        await interaction.response.send_message(embed=embed)
+        await send_response(interaction, f"You played `{move}`.", ephemeral=True)
         
     elif game_type == 'ai':
         # AI game logic
-        player_id = game_state['players'][0]
+        player_id = game_state.players[0]
         if interaction.user.id != player_id:
-            await interaction.response.send_message("You are not in the current game.", ephemeral=True)
+            await send_response(interaction, "You are not in the current game.", ephemeral=True)
+            return
+        
+        # Refuse the move rather than queue it behind too many AI searches
+        if ai_pool.overloaded():
+            await send_response(interaction, "The AI is very busy right now. Please try your move again in a moment.",
+                                ephemeral=True)
             return
         
-        board.push(user_move)
-        save_games()  # Save after move
+        push_move(channel_id, board, user_move)
         
         if board.is_game_over():
-            await handle_game_over(interaction, board, move, board.result(), game_state['players'], game_type)
+            await handle_game_over(interaction, board, move, board.result(), game_state.players, game_type,
+                                   difficulty=game_state.difficulty)
             return
         
-        # AI's turn
-        ai = game_state['ai']
-        ai_move = ai.get_best_move(board)
+        await play_ai_reply(interaction, game_state, move)
+
+async def play_ai_reply(interaction, game_state, move):
+    """Search and play the AI's reply to the player's move"""
+    channel_id = interaction.channel.id
+    board = game_state.board
+    game_type = game_state.type
+    
+    # AI's turn - the search runs in a worker process, so acknowledge
+    # the interaction first and keep the event loop free while it thinks
+    if not interaction.response.is_done():
+        await interaction.response.defer(ephemeral=True, thinking=True)
+    
+    # Show the player's move now; a quick AI reply is merged into the same edit
+    embed = discord.Embed(
+        title="♟️ Move Made",
+        description=f"You played: `{move}`\n\nAI is thinking...",
+        color=0x8B4513
+    )
+    await post_board(interaction, embed, board, game_state.difficulty)
+    
+    search_started = time.perf_counter()
+    try:
+        ai_move, stats = await ai_pool.search(channel_id, board, game_state.difficulty)
+    except Exception as e:
+        # E.g. the worker process died; give the player their turn back
+        print(f"Error searching AI move in {channel_id}: {e}")
+        if board.move_stack:
+            pop_move(channel_id, board)
+        embed = discord.Embed(
+            title="♟️ Move Taken Back",
+            description=f"The AI could not answer `{move}`, so it was taken back.\n\nYour turn!",
+            color=0x8B4513
+        )
+        await post_board(interaction, embed, board, game_state.difficulty)
+        await send_response(interaction, "Something went wrong while the AI was thinking. Please make your move again.",
+                            ephemeral=True)
+        return
+    
+    metrics.observe_ai_move(stats, time.perf_counter() - search_started)
+    print(f"AI move in {channel_id}: {ai_move} ({stats['nodes']} nodes, "
+          f"depth {stats['depth']}, {stats['time']:.2f}s, {stats['nps']} nps, {stats['source']}, "
+          f"waited {stats['wait']:.2f}s{', degraded' if stats['degraded'] else ''})")
+    
+    if ai_move:
+        push_move(channel_id, board, ai_move)
+    
+    if board.is_game_over():
+        await handle_game_over(interaction, board, move, board.result(), game_state.players, game_type, ai_move,
+                               game_state.difficulty)
+    else:
+        embed = discord.Embed(
+            title="♟️ Moves Made",
+            description=f"You played: `{move}`\nAI played: `{ai_move}`\n\nYour turn!",
+            color=0x8B4513
+        )
+        await post_board(interaction, embed, board, game_state.difficulty)
         
-        if ai_move:
-            board.push(ai_move)
-            save_games()  # Save after AI move
+        await send_response(interaction, f"You played `{move}`, AI played `{ai_move}`.", ephemeral=True)
         
-        if board.is_game_over():
-            await handle_game_over(interaction, board, move, board.result(), game_state['players'], game_type, ai_move)
-        else:
-            embed = discord.Embed(
-                title="♟️ Moves Made",
-                description=f"You played: `{move}`\nAI played: `{ai_move}`\n\nYour turn!",
-                color=0x8B4513
-            )
-            embed.add_field(name="Board", value=f"```\n{board.unicode()}\n```", inline=False)
-            
-            await interaction.response.send_message(embed=embed)
+        # Think ahead on the player's likely reply while they decide
+        ai_pool.start_ponder(channel_id, board, game_state.difficulty)
+
+async def send_response(interaction, content=None, **kwargs):
+    """Reply to an interaction, using a followup if it was already deferred"""
+    if interaction.response.is_done():
+        await interaction.followup.send(content, **kwargs)
+    else:
+        await interaction.response.send_message(content, **kwargs)
+
+async def run_in_channel(interaction, key, args, handler, *handler_args):
+    """Run a command handler with the channel to itself
+    
+    Requests that repeat one already queued or running are turned away, and
+    a queued request is skipped if the same user sends a newer one of the
+    same kind before it starts.
+    """
+    ticket = channel_scheduler.submit(interaction.channel.id, key, args)
+    if ticket is None:
+        await interaction.response.send_message("That request is already being processed.", ephemeral=True)
+        return
+    
+    if ticket.must_wait:
+        # Acknowledge now so the interaction cannot expire while it waits
+        try:
+            await interaction.response.defer(ephemeral=True, thinking=True)
+        except Exception:
+            # Don't leave the ticket behind to turn away every later request like it
+            channel_scheduler.cancel(ticket)
+            raise
+    
+    async with ticket:
+        if ticket.stale:
+            await send_response(interaction, "Skipped in favour of your newer request.", ephemeral=True)
+            return
+        await handler(interaction, *handler_args)
+
+async def post_board(interaction, embed, board, difficulty=None, final=False):
+    """Render the board into an embed and show it in the channel's game message
+    
+    Where the bot may not post (no Send Messages permission, DMs of user
+    installs) the board is sent as a reply to the interaction instead.
+    """
+    png = await board_renderer.render_async(board, difficulty, interaction.channel.id)
+    embed.set_image(url="attachment://chess_board.png")
+    if not game_messages.can_post(interaction.channel.id):
+        await send_response(interaction, embed=embed, file=discord.File(io.BytesIO(png), filename="chess_board.png"))
+        return
+    
+    async def reply(embed, files):
+        await interaction.followup.send(embed=embed, files=files)
+    
+    game_messages.update(interaction.channel, embed, png, final, reply)
 
-async def handle_game_over(interaction, board, last_move, result, players, game_type, ai_move=None):
+async def handle_game_over(interaction, board, last_move, result, players, game_type, ai_move=None, difficulty=None):
     """Handle the end of a game"""
     channel_id = interaction.channel.id
     
@@ -502,50 +526,76 @@ async def handle_game_over(interaction, board, last_move, result, players, game_
         
         embed.description = f"{move_text}\n\n{result_text}"
     
-    embed.add_field(name="Final Board", value=f"```\n{board.unicode()}\n```", inline=False)
     embed.add_field(name="Result", value=f"`{result}`", inline=False)
+    await post_board(interaction, embed, board, difficulty, final=True)
     
-    await interaction.response.send_message(embed=embed)
+    await send_response(interaction, f"Game over: `{result}` - use `/analyze` to review it", ephemeral=True)
+    remember_finished_game(channel_id, board)
     del active_games[channel_id]
-    save_games()  # Save after game ends
+    game_store.record_end(channel_id)
+    board_renderer.forget(channel_id)
+
+def can_end_game(interaction, game_state):
+    """Whether the user is a participant in the game or has manage messages permission"""
+    user_id = interaction.user.id
+    has_manage_permission = False
+    if interaction.guild:
+        member = interaction.guild.get_member(user_id)
+        has_manage_permission = member and member.guild_permissions.manage_messages
+    return user_id in game_state.players or has_manage_permission
 
 @bot.tree.command(name="end", description="End the current chess game")
 async def end_game(interaction: discord.Interaction):
     """End the current chess game"""
+    # Don't wait for an AI search to finish before the game can end
+    game_state = active_games.get(interaction.channel.id)
+    if game_state is not None and can_end_game(interaction, game_state):
+        ai_pool.cancel(interaction.channel.id)
+    
+    await run_in_channel(interaction, ('end', interaction.user.id), None, end_current_game)
+
+async def end_current_game(interaction):
+    """End the current chess game, with the channel to ourselves"""
     channel_id = interaction.channel.id
     
     if channel_id not in active_games:
-        await interaction.response.send_message("No game is currently in progress to end.", ephemeral=True)
+        await send_response(interaction, "No game is currently in progress to end.", ephemeral=True)
         return
     
     game_state = active_games[channel_id]
-    user_id = interaction.user.id
     
-    # Check if user is a participant in the game or has manage messages permission  
-    has_manage_permission = False
-    if interaction.guild:
-        member = interaction.guild.get_member(user_id)
-        has_manage_permission = member and member.guild_permissions.manage_messages
-    
-    if user_id not in game_state['players'] and not has_manage_permission:
-        await interaction.response.send_message("You can only end games you're participating in!", ephemeral=True)
+    if not can_end_game(interaction, game_state):
+        await send_response(interaction, "You can only end games you're participating in!", ephemeral=True)
         return
     
+    ai_pool.cancel(channel_id)  # Stop pondering
+    embed = discord.Embed(
+        title="♟️ Game Ended",
+        description=f"The game was ended by **{interaction.user.mention}**.",
+        color=0x8B4513
+    )
+    await post_board(interaction, embed, game_state.board, game_state.difficulty, final=True)
+    remember_finished_game(channel_id, game_state.board)
     del active_games[channel_id]
-    save_games()  # Save after manually ending game
-    await interaction.response.send_message("The current chess game has been ended.", ephemeral=True)
+    game_store.record_end(channel_id)
+    board_renderer.forget(channel_id)
+    await send_response(interaction, "The current chess game has been ended.", ephemeral=True)
 
 @bot.tree.command(name="show", description="Show the current chess board")
 async def show_board(interaction: discord.Interaction):
     """Show the current board state"""
+    await run_in_channel(interaction, ('show', interaction.user.id), None, show_current_board)
+
+async def show_current_board(interaction):
+    """Show the current board state, with the channel to ourselves"""
     channel_id = interaction.channel.id
     
     if channel_id in active_games:
         game_state = active_games[channel_id]
-        board = game_state['board']
+        board = game_state.board
         
-        if game_state['type'] == 'pvp':
-            players = game_state['players']
+        if game_state.type == 'pvp':
+            players = game_state.players
             white_player = bot.get_user(players[0]) or (interaction.guild.get_member(players[0]) if interaction.guild else None)
             black_player = bot.get_user(players[1]) or (interaction.guild.get_member(players[1]) if interaction.guild else None)
             current_player = white_player if board.turn == chess.WHITE else black_player
@@ -554,11 +604,11 @@ async def show_board(interaction: discord.Interaction):
             current_mention = current_player.mention if current_player else (white_mention if board.turn == chess.WHITE else black_mention)
             description = f"**White:** {white_mention}\n**Black:** {black_mention}\n\n**{current_mention}'s** turn"
         else:
-            description = f"You vs AI (Difficulty: {game_state['difficulty']})\n\n{'Your' if board.turn == chess.WHITE else 'AI'} turn"
+            description = f"You vs AI (Difficulty: {game_state.difficulty})\n\n{'Your' if board.turn == chess.WHITE else 'AI'} turn"
         
         # Generate board image (pass difficulty for AI games)
-        difficulty = game_state.get('difficulty') if game_state['type'] == 'ai' else None
-        board_image = generate_chess_board_image(board, difficulty)
+        difficulty = game_state.difficulty if game_state.type == 'ai' else None
+        board_image = io.BytesIO(await board_renderer.render_async(board, difficulty, channel_id))
         
         embed = discord.Embed(
             title="♟️ Current Board",
@@ -570,9 +620,102 @@ async def show_board(interaction: discord.Interaction):
         file = discord.File(board_image, filename="chess_board.png")
         embed.set_image(url="attachment://chess_board.png")
         
-        await interaction.response.send_message(embed=embed, file=file, ephemeral=True)
+        await send_response(interaction, embed=embed, file=file, ephemeral=True)
     else:
-        await interaction.response.send_message("No game is currently in progress.", ephemeral=True)
+        await send_response(interaction, "No game is currently in progress.", ephemeral=True)
+
+@bot.tree.command(name="analyze", description="Analyze a game: a PGN, or the last game finished in this channel")
+@app_commands.describe(pgn="The game as PGN text", file="The game as a .pgn file")
+async def analyze_game(interaction: discord.Interaction, pgn: str = None, file: discord.Attachment = None):
+    """Evaluate every position of a game and list its mistakes"""
+    user_id = interaction.user.id
+    if user_id in running_analyses:
+        await interaction.response.send_message("Your previous analysis is still running.", ephemeral=True)
+        return
+    
+    running_analyses.add(user_id)
+    try:
+        await run_analysis(interaction, pgn, file)
+    finally:
+        running_analyses.discard(user_id)
+
+async def run_analysis(interaction, pgn, file):
+    """Analyze a game, while the user is marked as having an analysis running"""
+    # Reading the file and evaluating take a while; acknowledge first
+    await interaction.response.defer(thinking=True)
+    
+    if file is not None:
+        if file.size > MAX_PGN_BYTES:
+            await interaction.edit_original_response(content="That PGN file is too large.")
+            return
+        pgn = (await file.read()).decode('utf-8', errors='replace')
+    
+    if pgn:
+        game = chess.pgn.read_game(io.StringIO(pgn))
+        if game is None or game.errors:
+            await interaction.edit_original_response(content="I couldn't read that PGN.")
+            return
+        board = game.end().board()
+        title = f"{game.headers.get('White', '?')} vs {game.headers.get('Black', '?')}"
+    else:
+        board = finished_games.get(interaction.channel.id)
+        if board is None:
+            await interaction.edit_original_response(
+                content="No game has finished in this channel yet. Give me a PGN to analyze instead.")
+            return
+        title = "Last game in this channel"
+    
+    if not board.move_stack:
+        await interaction.edit_original_response(content="That game has no moves to analyze.")
+        return
+    
+    last_progress = 0
+    
+    async def show_progress(done, total):
+        """Edit the response as positions come in, at most once per interval"""
+        nonlocal last_progress
+        now = time.monotonic()
+        if done == total or now - last_progress < ANALYSIS_PROGRESS_INTERVAL:
+            return
+        last_progress = now
+        try:
+            await interaction.edit_original_response(content=f"🔍 Analyzing... {done}/{total} positions")
+        except discord.HTTPException as e:
+            print(f"Error showing analysis progress: {e}")
+    
+    try:
+        evaluations = await analyzer.analyze(board, show_progress)
+        mistakes = find_mistakes(board, evaluations)
+        png = await asyncio.to_thread(draw_eval_graph, evaluations, mistakes)
+    except Exception as e:
+        print(f"Error analyzing game: {e}")
+        await interaction.edit_original_response(content="Sorry, the analysis failed.")
+        return
+    
+    embed = discord.Embed(
+        title="🔍 Game Analysis",
+        description=f"**{title}**\n{len(evaluations)} positions evaluated at depth {ANALYSIS_DEPTH}",
+        color=0x8B4513
+    )
+    lines = []
+    for ply, label, best_san, loss, blunder in mistakes[:15]:
+        line = f"**{label}{'??' if blunder else '?'}** (-{loss / 100:.1f})"
+        if best_san:
+            line += f" best was `{best_san}`"
+        lines.append(line)
+    if len(mistakes) > 15:
+        lines.append(f"...and {len(mistakes) - 15} more")
+    blunders = sum(1 for mistake in mistakes if mistake[4])
+    embed.add_field(
+        name=f"Blunders ({blunders}) and mistakes ({len(mistakes) - blunders})",
+        value='\n'.join(lines) or "No mistakes found! 🎉",
+        inline=False
+    )
+    embed.add_field(name="Final evaluation", value=f"`{evaluations[-1][0] / 100:+.2f}` (White's view)", inline=False)
+    embed.set_image(url="attachment://eval_graph.png")
+    
+    await interaction.edit_original_response(
+        content=None, embed=embed, attachments=[discord.File(io.BytesIO(png), filename="eval_graph.png")])
 
 @bot.tree.command(name="help", description="Show chess bot help")
 async def chess_help(interaction: discord.Interaction):
@@ -591,6 +734,7 @@ async def chess_help(interaction: discord.Interaction):
         `/move e2e4` - Make a move
         `/show` - Show current board as image
         `/end` - End current game
+        `/analyze` - Review the last game, or a PGN
         `/help` - Show this help
         """,
         inline=False
@@ -622,13 +766,19 @@ async def chess_help(interaction: discord.Interaction):
 
 if __name__ == "__main__":
     token = os.getenv('DISCORD_BOT_TOKEN')
-if not token:
-    print("❌ DISCORD_BOT_TOKEN environment variable not set!")
-    print("Please set your Discord bot token as a secret.")
-    exit(1)
+    if not token:
+        print("❌ DISCORD_BOT_TOKEN environment variable not set!")
+        print("Please set your Discord bot token as a secret.")
+        exit(1)
 
-# 1. ADD THE KEEP-ALIVE CALL HERE:
-keep_alive()
+    # 1. ADD THE KEEP-ALIVE CALL HERE:
+    keep_alive()
 
-print("🤖 Starting Chess Bot...")
-bot.run(token)
+    print("🤖 Starting Chess Bot...")
+    try:
+        bot.run(token)
+    finally:
+        ai_pool.shutdown()
+        analyzer.shutdown()
+        board_renderer.shutdown()
+        game_store.close()
@@ -0,0 +1,102 @@
+import os
+import time
+
+from game_store import replay_moves
+
+# Games untouched for this many seconds have their GameState and board dropped from memory
+GAME_IDLE_TTL = float(os.environ.get('GAME_IDLE_TTL', 1800))
+
+# How often the bot looks for idle games, in seconds
+GAME_EVICT_INTERVAL = float(os.environ.get('GAME_EVICT_INTERVAL', 60))
+
+class GameState:
+    """A resident game; the board is only built from its packed moves when first used"""
+
+    __slots__ = ('players', 'type', 'difficulty', 'last_used', '_board', '_start_fen', '_moves')
+
+    def __init__(self, players, game_type, difficulty=None, board=None, start_fen=None, moves=None):
+        self.players = players
+        self.type = game_type
+        self.difficulty = difficulty
+        self.last_used = time.monotonic()
+        self._board = board
+        self._start_fen = start_fen
+        self._moves = moves
+
+    @classmethod
+    def from_stored(cls, game):
+        """Build a GameState from a game returned by GameStore.get()"""
+        return cls(game['players'], game['type'], game.get('difficulty'),
+                   start_fen=game['start_fen'], moves=game['moves'])
+
+    @property
+    def board(self):
+        board = self._board
+        if board is None:
+            board = self._board = replay_moves(self._start_fen, self._moves)
+            self._start_fen = self._moves = None
+        return board
+
+class GameRegistry:
+    """Active games by channel ID, built in memory only while they are in use
+
+    Every game lives in the GameStore's compact copy. A GameState is built
+    the first time a channel's game is looked up and is dropped again once
+    it has been idle for longer than the TTL; the next lookup rebuilds it
+    from the store. Nothing needs to be written on eviction because every
+    change is journaled as it happens.
+
+    Only the GameState and its chess.Board are evicted. The store's compact
+    copy (start position plus two bytes per ply) of every active game stays
+    in memory until the game ends, with the SQLite store as well, so memory
+    still grows with the number of active games, just far more slowly.
+    """
+
+    def __init__(self, store, ttl=GAME_IDLE_TTL):
+        self.store = store
+        self.ttl = ttl
+
+        # Games currently in memory
+        # Key: channel ID
+        # Value: GameState
+        self.resident = {}
+
+    def __contains__(self, channel_id):
+        return channel_id in self.resident or channel_id in self.store
+
+    def __len__(self):
+        return len(self.store)
+
+    def get(self, channel_id):
+        """Get a channel's game, loading it from the store if needed; None if there is none"""
+        game_state = self.resident.get(channel_id)
+        if game_state is None:
+            game = self.store.get(channel_id)
+            if game is None:
+                return None
+            game_state = self.resident[channel_id] = GameState.from_stored(game)
+        game_state.last_used = time.monotonic()
+        return game_state
+
+    def __getitem__(self, channel_id):
+        game_state = self.get(channel_id)
+        if game_state is None:
+            raise KeyError(channel_id)
+        return game_state
+
+    def __setitem__(self, channel_id, game_state):
+        self.resident[channel_id] = game_state
+
+    def __delitem__(self, channel_id):
+        self.resident.pop(channel_id, None)
+
+    def evict_idle(self, now=None):
+        """Drop games idle for longer than the TTL from memory; returns how many were dropped"""
+        if now is None:
+            now = time.monotonic()
+        cutoff = now - self.ttl
+        idle = [channel_id for channel_id, game_state in self.resident.items()
+                if game_state.last_used < cutoff]
+        for channel_id in idle:
+            del self.resident[channel_id]
+        return len(idle)
@@ -0,0 +1,284 @@
+import base64
+import json
+import os
+import queue
+import sys
+import threading
+from array import array
+
+import chess
+
+import metrics
+
+# Snapshot of every active game, rewritten atomically when the journal is compacted
+SNAPSHOT_PATH = 'saved_games.json'
+
+# Append-only log of every change since the last snapshot, one JSON record per line
+JOURNAL_PATH = 'saved_games.journal'
+
+# Fold the journal into a fresh snapshot after this many records
+COMPACT_EVERY = int(os.environ.get('GAME_JOURNAL_COMPACT_EVERY', 1000))
+
+def pack_move(move):
+    """Pack a chess.Move into 16 bits: from | to << 6 | promotion << 12"""
+    return move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+
+def unpack_move(value):
+    """Unpack a 16-bit move back into a chess.Move"""
+    return chess.Move(value & 63, (value >> 6) & 63, (value >> 12) or None)
+
+def moves_to_bytes(moves):
+    """Serialise a move array as little-endian 16-bit values"""
+    moves = array('H', moves)
+    if sys.byteorder != 'little':
+        moves.byteswap()
+    return moves.tobytes()
+
+def moves_from_bytes(data):
+    """Read the output of moves_to_bytes() back into a move array"""
+    moves = array('H')
+    moves.frombytes(data)
+    if sys.byteorder != 'little':
+        moves.byteswap()
+    return moves
+
+def encode_moves(moves):
+    """Encode a move array as base64 of little-endian 16-bit values"""
+    return base64.b64encode(moves_to_bytes(moves)).decode('ascii')
+
+def decode_moves(data):
+    """Decode the output of encode_moves() back into a move array"""
+    return moves_from_bytes(base64.b64decode(data))
+
+def replay_moves(start_fen, moves):
+    """Rebuild a board, with its full move stack, from a start position and packed moves"""
+    board = chess.Board(start_fen)
+    for value in moves:
+        board.push(unpack_move(value))
+    return board
+
+class GameStore:
+    """Persists games as an append-only journal plus periodic snapshots
+
+    record_start(), record_move() and record_end() update a compact copy of
+    every game and queue a small record, so they cost the same no matter how
+    many games are active. A background thread appends the records to the
+    journal. After COMPACT_EVERY records it writes the compact copy to a new
+    snapshot and truncates the journal. get() hands out a game from that
+    copy, so callers can drop their boards and fetch them again later. The
+    copy itself holds every active game until it ends; it is never evicted.
+
+    Games are kept as their start position plus every move packed into an
+    array of 16-bit values (two bytes per ply), so history survives restarts
+    without keeping a chess.Board per game; see replay_moves().
+
+    Move and take-back records carry the ply they refer to, so replaying a journal
+    over a snapshot that already contains some of its moves is harmless. A
+    crash between writing the snapshot and truncating the journal therefore
+    loses nothing. A line torn by a crash is skipped on load.
+    """
+
+    def __init__(self, snapshot_path=SNAPSHOT_PATH, journal_path=JOURNAL_PATH, compact_every=COMPACT_EVERY):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.compact_every = compact_every
+        self.queue = queue.Queue()
+        self.thread = None
+
+        # Compact copy of every game, shared with the writer thread
+        # Key: channel ID
+        # Value: dictionary with 'start_fen', 'moves', 'players', 'type', 'difficulty'
+        self.games = {}
+        self.lock = threading.Lock()
+
+    def __contains__(self, channel_id):
+        return channel_id in self.games
+
+    def __len__(self):
+        return len(self.games)
+
+    def count_by_type(self):
+        """Number of stored games of each type"""
+        counts = {}
+        with self.lock:
+            for game in self.games.values():
+                counts[game['type']] = counts.get(game['type'], 0) + 1
+        return counts
+
+    def get(self, channel_id):
+        """Get a copy of a stored game, or None if the channel has no game"""
+        with self.lock:
+            game = self.games.get(channel_id)
+            if game is None:
+                return None
+            return dict(game, moves=array('H', game['moves']))
+
+    def load(self):
+        """Read the snapshot and replay the journal; returns the games by channel ID
+
+        Each game is a dictionary with 'start_fen', 'moves' (packed move
+        array), 'players', 'type' and 'difficulty'. No boards are built here.
+        """
+        games = {}
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r') as f:
+                for channel_id_str, game_data in json.load(f).items():
+                    games[int(channel_id_str)] = {
+                        # Older snapshots only stored the current position
+                        'start_fen': game_data.get('start_fen', game_data.get('board_fen')),
+                        'moves': decode_moves(game_data.get('moves', '')),
+                        'players': tuple(game_data['players']),
+                        'type': game_data['type'],
+                        'difficulty': game_data.get('difficulty'),
+                        'guild_id': game_data.get('guild_id')
+                    }
+
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn write from a crash; the records around it are intact
+                        continue
+                    self._apply(games, record)
+
+        return games
+
+    def _apply(self, games, record):
+        """Apply one journal record to a games dictionary"""
+        channel_id = record['c']
+        op = record['op']
+        if op == 'start':
+            games[channel_id] = {
+                'start_fen': record['fen'],
+                'moves': array('H'),
+                'players': tuple(record['players']),
+                'type': record['type'],
+                'difficulty': record.get('difficulty'),
+                'guild_id': record.get('g')
+            }
+        elif op == 'move':
+            game = games.get(channel_id)
+            # Skip moves the snapshot already contains
+            if game and len(game['moves']) == record['p']:
+                game['moves'].append(pack_move(chess.Move.from_uci(record['m'])))
+        elif op == 'undo':
+            game = games.get(channel_id)
+            if game:
+                del game['moves'][record['p']:]
+        elif op == 'end':
+            games.pop(channel_id, None)
+
+    def start(self, games):
+        """Start the background writer from the games returned by load()"""
+        if self.thread is None:
+            with self.lock:
+                self.games = {channel_id: dict(game, moves=array('H', game['moves']))
+                              for channel_id, game in games.items()}
+            self.thread = threading.Thread(target=self._run, name='game-store', daemon=True)
+            self.thread.start()
+
+    def close(self):
+        """Write everything still queued, compact, and stop the writer"""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def record_start(self, channel_id, board, players, game_type, difficulty=None, guild_id=None):
+        """Journal a new game; guild_id (None in DMs) decides which gateway shard owns it"""
+        self._record({'op': 'start', 'c': channel_id, 'fen': board.fen(), 'players': list(players),
+                      'type': game_type, 'difficulty': difficulty, 'g': guild_id})
+
+    def record_move(self, channel_id, move, ply):
+        """Journal a move (UCI) played at the given ply, counted from the game's start position"""
+        self._record({'op': 'move', 'c': channel_id, 'm': move, 'p': ply})
+
+    def record_undo(self, channel_id, ply):
+        """Journal taking back every move from the given ply on"""
+        self._record({'op': 'undo', 'c': channel_id, 'p': ply})
+
+    def record_end(self, channel_id):
+        """Journal the end of a game"""
+        self._record({'op': 'end', 'c': channel_id})
+
+    def _record(self, record):
+        """Apply a record to the compact copy and queue it for the journal"""
+        with self.lock:
+            self._apply(self.games, record)
+        self.queue.put(record)
+
+    def _next_batch(self):
+        """Wait for queued records and take all of them; returns (records, keep running)"""
+        records = [self.queue.get()]
+        # Drain whatever else is queued so it goes out in one write
+        while True:
+            try:
+                records.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+
+        if None in records:
+            return [record for record in records if record is not None], False
+        return records, True
+
+    def _run(self):
+        """Writer thread: append queued records, compacting now and then"""
+        journal = open(self.journal_path, 'a+')
+        # Terminate a line torn by a crash so new records start cleanly
+        if journal.tell() > 0:
+            journal.seek(journal.tell() - 1)
+            if journal.read(1) != '\n':
+                journal.write('\n')
+        pending = 0
+        running = True
+        while running:
+            records, running = self._next_batch()
+            try:
+                if records:
+                    with metrics.PERSIST_WRITE_SECONDS.time():
+                        journal.write(''.join(json.dumps(record, separators=(',', ':')) + '\n'
+                                              for record in records))
+                        journal.flush()
+                    metrics.PERSIST_RECORDS.inc(amount=len(records))
+                pending += len(records)
+
+                if pending >= self.compact_every or (not running and pending):
+                    journal.close()
+                    with metrics.PERSIST_COMPACT_SECONDS.time():
+                        self._compact()
+                    journal = open(self.journal_path, 'a')
+                    pending = 0
+            except Exception as e:
+                print(f"Error saving games: {e}")
+        journal.close()
+
+    def _compact(self):
+        """Atomically replace the snapshot with the current games, then empty the journal
+
+        The copy may already hold records that are still queued. They are
+        journaled after the truncation and replay idempotently over the
+        snapshot, so nothing is lost or applied twice.
+        """
+        games_data = {}
+        with self.lock:
+            for channel_id, game in self.games.items():
+                games_data[str(channel_id)] = {
+                    'start_fen': game['start_fen'],
+                    'moves': encode_moves(game['moves']),
+                    'players': list(game['players']),
+                    'type': game['type'],
+                    'difficulty': game.get('difficulty'),
+                    'guild_id': game.get('guild_id')
+                }
+
+        temp_path = self.snapshot_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(games_data, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.snapshot_path)
+
+        # Only now is it safe to drop the journal's contents
+        open(self.journal_path, 'w').close()
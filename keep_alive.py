@@ -1,12 +1,26 @@
-from flask import Flask
+from flask import Flask, Response, jsonify
 from threading import Thread
 
+import loop_watchdog
+import metrics
+
 app = Flask('') 
 
 @app.route('/')
 def home():
     return "I'm alive!"
 
+@app.route('/health')
+def health():
+    # 503 while the bot's event loop is blocked, with recent stalls and their stacks
+    data, status = loop_watchdog.health()
+    return jsonify(data), status
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # Prometheus text exposition format
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 import os
 # ... other imports
 
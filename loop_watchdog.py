@@ -0,0 +1,138 @@
+import asyncio
+import collections
+import os
+import sys
+import threading
+import time
+import traceback
+import weakref
+
+import metrics
+
+# How often the event loop is expected to check in, in seconds
+WATCHDOG_INTERVAL = float(os.environ.get('WATCHDOG_INTERVAL', 0.1))
+
+# Blocking the loop for longer than this counts as a stall
+WATCHDOG_THRESHOLD = float(os.environ.get('WATCHDOG_THRESHOLD', 0.5))
+
+# Stalls kept for the health endpoint
+STALL_HISTORY = 20
+
+LOOP_LAG = metrics.Histogram(
+    'chess_event_loop_lag_seconds', "How late the event loop ran a timer that was due",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+LOOP_STALLS = metrics.Counter('chess_event_loop_stalls_total', "Times the event loop was blocked past the threshold")
+
+# The watchdog that has been started, for health()
+_active = None
+
+class LoopWatchdog:
+    """Detects a blocked event loop and records what was blocking it
+
+    A task on the loop wakes every WATCHDOG_INTERVAL and notes the time;
+    how late it wakes is the loop lag. A monitor thread checks that time,
+    and when the loop has not checked in for longer than the threshold it
+    grabs the loop thread's current stack. It also records the channel and
+    command of the task that was running, as tagged with tag(). The stall
+    is logged at once and again with its full length when the loop recovers.
+    """
+
+    def __init__(self, interval=WATCHDOG_INTERVAL, threshold=WATCHDOG_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.loop = None
+        self.loop_thread_id = None
+        self.last_beat = time.monotonic()
+        self.lag = 0.0
+        self.current_stall = None
+        self.stalls = collections.deque(maxlen=STALL_HISTORY)
+
+        # What each running task is working on
+        # Key: asyncio task
+        # Value: (channel ID, command name)
+        self.task_context = weakref.WeakKeyDictionary()
+
+    def start(self, loop):
+        """Start watching a running loop; call from the loop's own thread"""
+        global _active
+        if self.loop is not None:
+            return
+        self.loop = loop
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        loop.create_task(self._heartbeat())
+        threading.Thread(target=self._monitor, name='loop-watchdog', daemon=True).start()
+        _active = self
+
+    def tag(self, channel_id, command):
+        """Note the channel and command the current task is handling"""
+        task = asyncio.current_task()
+        if task is not None:
+            self.task_context[task] = (channel_id, command)
+
+    def blocked_for(self):
+        """How long the loop has gone without checking in past its due time"""
+        return max(0.0, time.monotonic() - self.last_beat - self.interval)
+
+    async def _heartbeat(self):
+        while True:
+            due = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.lag = max(0.0, now - due)
+            self.last_beat = now
+            LOOP_LAG.observe(self.lag)
+
+            stall = self.current_stall
+            if stall is not None:
+                self.current_stall = None
+                stall['duration'] = self.lag
+                print(f"Event loop recovered after {self.lag:.2f}s "
+                      f"(command {stall['command']}, channel {stall['channel_id']})")
+
+    def _monitor(self):
+        while True:
+            time.sleep(self.interval)
+            blocked = self.blocked_for()
+            if blocked > self.threshold and self.current_stall is None:
+                self._capture(blocked)
+
+    def _capture(self, blocked):
+        """Record the loop thread's stack and the task it is running"""
+        frame = sys._current_frames().get(self.loop_thread_id)
+        stack = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+
+        channel_id = command = None
+        task = asyncio.current_task(self.loop)
+        if task is not None:
+            channel_id, command = self.task_context.get(task, (None, None))
+
+        stall = {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() - blocked)),
+            'blocked_seconds': round(blocked, 3),
+            'duration': None,
+            'channel_id': channel_id,
+            'command': command,
+            'stack': stack,
+        }
+        self.current_stall = stall
+        self.stalls.append(stall)
+        LOOP_STALLS.inc()
+        print(f"Event loop blocked for {blocked:.2f}s (command {command}, channel {channel_id}):\n{stack}")
+
+def health():
+    """Event loop health for the keep_alive endpoint; returns (data, HTTP status)"""
+    watchdog = _active
+    if watchdog is None:
+        return {'status': 'starting'}, 200
+
+    blocked = watchdog.blocked_for()
+    stalled = blocked > watchdog.threshold
+    data = {
+        'status': 'stalled' if stalled else 'ok',
+        'blocked_seconds': round(blocked, 3),
+        'loop_lag_seconds': round(watchdog.lag, 4),
+        'threshold_seconds': watchdog.threshold,
+        'stalls': list(watchdog.stalls),
+    }
+    return data, 503 if stalled else 200
@@ -0,0 +1,197 @@
+"""Low-overhead instrumentation exported in the Prometheus text format
+
+Metrics are plain objects registered at import time. Recording a value
+is a dictionary lookup, a bisect and a few additions under a lock, so it
+is cheap enough for every command, search, render and journal write.
+render() produces the text served by keep_alive's /metrics route.
+"""
+import bisect
+import threading
+import time
+
+# Every metric, in the order it was created
+_metrics = []
+
+# Histogram bucket bounds in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+
+        # Key: tuple of label values
+        # Value: the metric's value(s) for those labels
+        self.values = {}
+        _metrics.append(self)
+
+    def samples(self):
+        """Yield (suffix, label values, extra label, value) for the exposition"""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for suffix, label_values, extra, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(self.labels, label_values, extra)} '
+                         f'{_format_value(value)}')
+        return '\n'.join(lines)
+
+class Counter(_Metric):
+    """A value that only goes up"""
+    type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            items = list(self.values.items())
+        for label_values, value in items:
+            yield '', label_values, None, value
+
+class Gauge(_Metric):
+    """A value that can go up and down, set directly or read from a callback when scraped
+
+    The callback returns a number, or a dictionary from label values to numbers.
+    """
+    type = 'gauge'
+
+    def __init__(self, name, help, labels=(), callback=None):
+        super().__init__(name, help, labels)
+        self.callback = callback
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+    def samples(self):
+        if self.callback is not None:
+            try:
+                values = self.callback()
+            except Exception as e:
+                print(f"Error reading metric {self.name}: {e}")
+                return
+            if not isinstance(values, dict):
+                values = {(): values}
+            for label_values, value in values.items():
+                if not isinstance(label_values, tuple):
+                    label_values = (label_values,)
+                yield '', label_values, None, value
+            return
+
+        with self.lock:
+            items = list(self.values.items())
+        for label_values, value in items:
+            yield '', label_values, None, value
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets"""
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                # Per-bucket counts (plus +Inf), sum, count
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def time(self, *labels):
+        """Context manager that observes the duration of its block"""
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self.lock:
+            items = [(labels, list(entry[0]), entry[1], entry[2]) for labels, entry in self.values.items()]
+        for label_values, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                yield '_bucket', label_values, f'le="{_format_value(bound)}"', cumulative
+            yield '_sum', label_values, None, total
+            yield '_count', label_values, None, count
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    return '\n'.join(metric.render() for metric in _metrics) + '\n'
+
+# Metrics fed by the bot
+
+COMMAND_SECONDS = Histogram(
+    'chess_command_seconds', "Slash command latency from dispatch to completion",
+    labels=('command', 'status'))
+
+ACTIVE_GAMES = Gauge('chess_active_games', "Active games by type", labels=('type',))
+RESIDENT_GAMES = Gauge('chess_resident_games', "Active games currently held in memory")
+
+AI_MOVE_SECONDS = Histogram(
+    'chess_ai_move_seconds', "Wall time from asking for an AI move to getting it, by how it was chosen",
+    labels=('source',))
+AI_DEPTH = Histogram(
+    'chess_ai_depth', "Deepest completed search iteration per AI move",
+    buckets=(1, 2, 3, 4, 5, 6, 7, 8, 10, 12))
+AI_NODES = Counter('chess_ai_nodes_total', "Positions searched by the AI")
+AI_SEARCH_SECONDS = Counter('chess_ai_search_seconds_total', "Time spent searching; nodes / seconds gives nps")
+AI_LAST_NPS = Gauge('chess_ai_last_nps', "Nodes per second of the most recent search")
+
+RENDER_SECONDS = Histogram(
+    'chess_render_seconds', "Board image draw and PNG encode time",
+    labels=('mode',))
+RENDER_CACHE = Counter('chess_render_cache_total', "Board image cache lookups", labels=('result',))
+
+STARTUP_SECONDS = Gauge(
+    'chess_startup_seconds', "Time spent in each startup phase; ready is the total time to ready",
+    labels=('phase',))
+
+PERSIST_WRITE_SECONDS = Histogram('chess_persist_write_seconds', "Journal append and flush time per batch")
+PERSIST_COMPACT_SECONDS = Histogram('chess_persist_compact_seconds', "Snapshot rewrite time")
+PERSIST_RECORDS = Counter('chess_persist_records_total', "Records written to the game journal")
+
+def observe_ai_move(stats, elapsed):
+    """Record the stats dictionary of one AI move and how long the caller waited for it"""
+    AI_MOVE_SECONDS.observe(elapsed, stats['source'])
+    if stats['source'] == 'search':
+        AI_DEPTH.observe(stats['depth'])
+        AI_NODES.inc(amount=stats['nodes'])
+        AI_SEARCH_SECONDS.inc(amount=stats['time'])
+        AI_LAST_NPS.set(stats['nps'])
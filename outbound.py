@@ -0,0 +1,189 @@
+import asyncio
+import io
+import os
+import time
+
+import discord
+
+import metrics
+
+# How long to wait for further updates before editing, so a burst becomes one edit
+OUTBOUND_COALESCE_DELAY = float(os.environ.get('OUTBOUND_COALESCE_DELAY', 0.25))
+
+# Discord's documented limits: 5 messages per 5 seconds per channel, and
+# 50 requests per second for the whole bot
+CHANNEL_BUCKET = (5, 5.0)
+GLOBAL_BUCKET = (50, 1.0)
+
+# After the bot is refused permission to post in a channel, how long to use
+# interaction replies there before trying a game message again, in seconds
+NO_ACCESS_RETRY = 600
+
+OUTBOUND_MESSAGES = metrics.Counter('chess_outbound_messages_total', "Game messages sent or edited", labels=('action',))
+OUTBOUND_COALESCED = metrics.Counter('chess_outbound_coalesced_total', "Game message updates merged into a later one")
+OUTBOUND_THROTTLE = metrics.Histogram('chess_outbound_throttle_seconds', "Time updates waited for a rate-limit bucket")
+
+def board_files(png):
+    """The attachments for a send; a discord.File can only be sent once"""
+    return [discord.File(io.BytesIO(png), filename="chess_board.png")] if png else []
+
+class TokenBucket:
+    """Client-side copy of a Discord rate-limit bucket"""
+
+    __slots__ = ('capacity', 'period', 'tokens', 'updated', 'blocked_until')
+
+    def __init__(self, capacity, period):
+        self.capacity = capacity
+        self.period = period
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self):
+        """Seconds until a request may be made"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / self.period)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) * self.period / self.capacity
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds):
+        """Discord told us to back off (a 429)"""
+        self.tokens = 0
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+class _Channel:
+    """One channel's game message and its pending update"""
+
+    __slots__ = ('channel', 'message', 'pending', 'final', 'task', 'bucket')
+
+    def __init__(self, channel, bucket):
+        self.channel = channel
+        self.message = None
+        self.pending = None
+        self.final = False
+        self.task = None
+        self.bucket = bucket
+
+class GameMessages:
+    """Keeps one message per channel showing its game, edited in place
+
+    update() only records the newest content and returns at once. A task per
+    channel waits OUTBOUND_COALESCE_DELAY, so that a quick series of updates
+    (a player's move and the AI's reply) becomes one edit. It then waits
+    until the channel's and the bot's rate-limit buckets have room and
+    sends. The buckets are tracked here, so sends are spaced out before
+    Discord would answer with a 429.
+    """
+
+    def __init__(self):
+        self.global_bucket = TokenBucket(*GLOBAL_BUCKET)
+
+        # Key: channel ID
+        # Value: _Channel
+        self.channels = {}
+
+        # Channels the bot may not post in (no Send Messages, user installs)
+        # Key: channel ID
+        # Value: time.monotonic() when it was refused
+        self.no_access = {}
+
+    def can_post(self, channel_id):
+        """Whether game messages can be used in a channel, as far as we know"""
+        refused = self.no_access.get(channel_id)
+        if refused is None:
+            return True
+        if time.monotonic() - refused > NO_ACCESS_RETRY:
+            del self.no_access[channel_id]
+            return True
+        return False
+
+    def update(self, channel, embed, png=None, final=False, fallback=None):
+        """Show new content in the channel's game message
+
+        With final=True the message is left as it is afterwards, and the
+        channel's next update starts a new message (e.g. for a new game).
+        If the bot may not post in the channel, fallback(embed, files) is
+        awaited instead, e.g. to send it as an interaction followup.
+        """
+        state = self.channels.get(channel.id)
+        previous = None
+        if state is None:
+            state = self.channels[channel.id] = _Channel(channel, TokenBucket(*CHANNEL_BUCKET))
+        elif state.final:
+            # The last game's final update is still to be sent; this one
+            # starts the next message once it has gone, with the same bucket
+            previous = state.task
+            state = self.channels[channel.id] = _Channel(channel, state.bucket)
+        elif state.pending is not None:
+            OUTBOUND_COALESCED.inc()
+        state.pending = (embed, png, time.monotonic(), fallback)
+        state.final = final
+        if state.task is None or state.task.done():
+            state.task = asyncio.create_task(self._flush(channel.id, state, previous))
+
+    async def _flush(self, channel_id, state, previous=None):
+        """Send a channel's pending updates, newest content only"""
+        if previous is not None:
+            await asyncio.wait([previous])
+        await asyncio.sleep(OUTBOUND_COALESCE_DELAY)
+        while state.pending is not None:
+            # Wait until both buckets have room
+            while True:
+                delay = max(state.bucket.delay(), self.global_bucket.delay())
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+
+            embed, png, queued, fallback = state.pending
+            final = state.final
+            state.pending = None
+            OUTBOUND_THROTTLE.observe(time.monotonic() - queued)
+
+            state.bucket.take()
+            self.global_bucket.take()
+            try:
+                await self._send(state, embed, png)
+            except discord.Forbidden as e:
+                print(f"Not allowed to post the game message in {channel_id}; replying instead: {e}")
+                self.no_access[channel_id] = time.monotonic()
+                state.message = None
+                if fallback is not None:
+                    try:
+                        await fallback(embed, board_files(png))
+                    except discord.HTTPException as e:
+                        print(f"Error sending game update in {channel_id}: {e}")
+            except discord.HTTPException as e:
+                if e.status == 429:
+                    retry_after = getattr(e, 'retry_after', None) or 1.0
+                    state.bucket.block(retry_after)
+                    # Try again with this content unless something newer arrived
+                    if state.pending is None:
+                        state.pending = (embed, png, queued, fallback)
+                    continue
+                print(f"Error updating game message in {channel_id}: {e}")
+
+            if final:
+                state.message = None
+
+        if state.message is None and self.channels.get(channel_id) is state:
+            del self.channels[channel_id]
+
+    async def _send(self, state, embed, png):
+        """Edit the game message, or post it if there is none (or it was deleted)"""
+        if state.message is not None:
+            try:
+                await state.message.edit(embed=embed, attachments=board_files(png))
+                OUTBOUND_MESSAGES.inc('edit')
+                return
+            except discord.NotFound:
+                state.message = None
+
+        state.message = await state.channel.send(embed=embed, files=board_files(png))
+        OUTBOUND_MESSAGES.inc('send')
@@ -0,0 +1,601 @@
+import chess
+import chess.polyglot
+
+# Moves are plain ints: from square | to square << 6 | promotion piece type << 12
+PROMOTION_SHIFT = 12
+
+# Deepest ply a search may reach from the root position
+MAX_SEARCH_PLY = 128
+
+# Castling rights as bit flags
+WHITE_KINGSIDE = 1
+WHITE_QUEENSIDE = 2
+BLACK_KINGSIDE = 4
+BLACK_QUEENSIDE = 8
+
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = chess.PAWN, chess.KNIGHT, chess.BISHOP, chess.ROOK, chess.QUEEN, chess.KING
+WHITE, BLACK = 1, 0
+
+BB_SQUARES = chess.BB_SQUARES
+BB_ALL = chess.BB_ALL
+KNIGHT_ATTACKS = chess.BB_KNIGHT_ATTACKS
+KING_ATTACKS = chess.BB_KING_ATTACKS
+# PAWN_ATTACKS[color][square] are the squares a pawn of that color attacks
+PAWN_ATTACKS = [chess.BB_PAWN_ATTACKS[chess.BLACK], chess.BB_PAWN_ATTACKS[chess.WHITE]]
+DIAG_MASKS, DIAG_ATTACKS = chess.BB_DIAG_MASKS, chess.BB_DIAG_ATTACKS
+FILE_MASKS, FILE_ATTACKS = chess.BB_FILE_MASKS, chess.BB_FILE_ATTACKS
+RANK_MASKS, RANK_ATTACKS = chess.BB_RANK_MASKS, chess.BB_RANK_ATTACKS
+
+# Castling rights that survive a move touching each square
+CASTLING_MASKS = [15] * 64
+CASTLING_MASKS[chess.A1] = 15 & ~WHITE_QUEENSIDE
+CASTLING_MASKS[chess.H1] = 15 & ~WHITE_KINGSIDE
+CASTLING_MASKS[chess.E1] = 15 & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLING_MASKS[chess.A8] = 15 & ~BLACK_QUEENSIDE
+CASTLING_MASKS[chess.H8] = 15 & ~BLACK_KINGSIDE
+CASTLING_MASKS[chess.E8] = 15 & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+
+# Polyglot Zobrist keys, so SearchBoard.key equals chess.polyglot.zobrist_hash()
+_RANDOM = chess.polyglot.POLYGLOT_RANDOM_ARRAY
+# ZOBRIST_PIECES[color][piece_type][square]
+ZOBRIST_PIECES = [
+    [[0] * 64] + [[_RANDOM[64 * ((piece_type - 1) * 2 + color) + square] for square in range(64)]
+                  for piece_type in chess.PIECE_TYPES]
+    for color in (BLACK, WHITE)
+]
+ZOBRIST_CASTLING = [0] * 16
+for _rights in range(16):
+    for _bit in range(4):
+        if _rights & (1 << _bit):
+            ZOBRIST_CASTLING[_rights] ^= _RANDOM[768 + _bit]
+ZOBRIST_EP_FILES = _RANDOM[772:780]
+ZOBRIST_TURN = _RANDOM[780]
+
+# Score tables used when none are given: every piece is worth nothing
+ZERO_TABLES = [[[0] * 64 for _ in range(7)] for _ in (BLACK, WHITE)]
+
+PROMOTION_LETTERS = ' pnbrqk'
+
+def make_move(from_square, to_square, promotion=0):
+    """Encode a move as an int"""
+    return from_square | to_square << 6 | promotion << PROMOTION_SHIFT
+
+def move_from_chess(move):
+    """Convert a chess.Move to the int encoding"""
+    return make_move(move.from_square, move.to_square, move.promotion or 0)
+
+def move_to_chess(move):
+    """Convert an int-encoded move to a chess.Move"""
+    return chess.Move(move & 63, (move >> 6) & 63, (move >> PROMOTION_SHIFT) or None)
+
+def move_to_uci(move):
+    """Format an int-encoded move in UCI notation"""
+    uci = chess.SQUARE_NAMES[move & 63] + chess.SQUARE_NAMES[(move >> 6) & 63]
+    promotion = move >> PROMOTION_SHIFT
+    return uci + PROMOTION_LETTERS[promotion] if promotion else uci
+
+class SearchBoard:
+    """Compact, search-only chess position
+
+    Holds bitboards per color and piece type plus a 64-entry mailbox, and
+    keeps the Polyglot Zobrist key and an evaluation score up to date
+    incrementally. Moves are ints (see make_move); make() and unmake() only
+    write into per-ply slots allocated up front, and make() returns False
+    (leaving the position unchanged) for pseudo-legal moves that would leave
+    the king in check. Only standard chess is supported.
+
+    score_tables[color][piece_type][square] gives each piece's contribution
+    to self.score; the search uses it as an incrementally updated evaluation.
+    """
+
+    __slots__ = (
+        'pieces', 'occupied_co', 'squares', 'turn', 'castling', 'ep_square',
+        'halfmove_clock', 'fullmove_number', 'key', 'score', 'score_tables',
+        'ply', 'keys', 'history_length', 'undo_move', 'undo_captured',
+        'undo_castling', 'undo_ep', 'undo_halfmove', 'undo_key', 'undo_score',
+    )
+
+    def __init__(self, board=None, score_tables=None):
+        if board is None:
+            board = chess.Board()
+        self.score_tables = score_tables or ZERO_TABLES
+
+        self.pieces = [[0] * 7, [0] * 7]
+        self.occupied_co = [0, 0]
+        self.squares = [0] * 64
+        self.score = 0
+        for square, piece in board.piece_map().items():
+            color = int(piece.color)
+            self.pieces[color][piece.piece_type] |= BB_SQUARES[square]
+            self.occupied_co[color] |= BB_SQUARES[square]
+            self.squares[square] = piece.piece_type
+            self.score += self.score_tables[color][piece.piece_type][square]
+
+        self.turn = int(board.turn)
+        self.castling = (
+            (WHITE_KINGSIDE if board.has_kingside_castling_rights(chess.WHITE) else 0) |
+            (WHITE_QUEENSIDE if board.has_queenside_castling_rights(chess.WHITE) else 0) |
+            (BLACK_KINGSIDE if board.has_kingside_castling_rights(chess.BLACK) else 0) |
+            (BLACK_QUEENSIDE if board.has_queenside_castling_rights(chess.BLACK) else 0)
+        )
+        self.ep_square = board.ep_square if board.ep_square is not None else -1
+        self.halfmove_clock = board.halfmove_clock
+        self.fullmove_number = board.fullmove_number
+        self.key = self.compute_key()
+
+        # Keys of earlier positions that can still repeat (since the last
+        # capture or pawn move), followed by one slot per search ply
+        history = []
+        previous = board.copy()
+        while previous.move_stack and len(history) < board.halfmove_clock:
+            previous.pop()
+            history.append(chess.polyglot.zobrist_hash(previous))
+        history.reverse()
+        self.history_length = len(history)
+        self.keys = history + [0] * (MAX_SEARCH_PLY + 1)
+        self.keys[self.history_length] = self.key
+
+        self.ply = 0
+        self.undo_move = [0] * MAX_SEARCH_PLY
+        self.undo_captured = [0] * MAX_SEARCH_PLY
+        self.undo_castling = [0] * MAX_SEARCH_PLY
+        self.undo_ep = [0] * MAX_SEARCH_PLY
+        self.undo_halfmove = [0] * MAX_SEARCH_PLY
+        self.undo_key = [0] * MAX_SEARCH_PLY
+        self.undo_score = [0] * MAX_SEARCH_PLY
+
+    def compute_key(self):
+        """Compute the Zobrist key from scratch"""
+        key = ZOBRIST_CASTLING[self.castling] ^ self.ep_key()
+        if self.turn == WHITE:
+            key ^= ZOBRIST_TURN
+        for color in (BLACK, WHITE):
+            for piece_type in chess.PIECE_TYPES:
+                table = ZOBRIST_PIECES[color][piece_type]
+                mask = self.pieces[color][piece_type]
+                while mask:
+                    lowest = mask & -mask
+                    key ^= table[lowest.bit_length() - 1]
+                    mask ^= lowest
+        return key
+
+    def ep_key(self):
+        """Zobrist component of the en passant square
+
+        Polyglot only hashes the en passant file when a pawn of the side to
+        move stands ready to capture.
+        """
+        ep_square = self.ep_square
+        if ep_square < 0:
+            return 0
+        if PAWN_ATTACKS[self.turn ^ 1][ep_square] & self.pieces[self.turn][PAWN]:
+            return ZOBRIST_EP_FILES[ep_square & 7]
+        return 0
+
+    def to_board(self):
+        """Convert back to a chess.Board (without move history)"""
+        return chess.Board(self.fen())
+
+    def fen(self):
+        """FEN of the current position"""
+        rows = []
+        for rank in range(7, -1, -1):
+            row = ''
+            empty = 0
+            for file in range(8):
+                square = rank * 8 + file
+                piece_type = self.squares[square]
+                if not piece_type:
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                letter = PROMOTION_LETTERS[piece_type]
+                row += letter.upper() if self.occupied_co[WHITE] & BB_SQUARES[square] else letter
+            rows.append(row + (str(empty) if empty else ''))
+
+        castling = ''.join(letter for flag, letter in (
+            (WHITE_KINGSIDE, 'K'), (WHITE_QUEENSIDE, 'Q'), (BLACK_KINGSIDE, 'k'), (BLACK_QUEENSIDE, 'q')
+        ) if self.castling & flag) or '-'
+        ep = chess.SQUARE_NAMES[self.ep_square] if self.ep_key() else '-'
+        return (f"{'/'.join(rows)} {'w' if self.turn == WHITE else 'b'} {castling} {ep} "
+                f"{self.halfmove_clock} {self.fullmove_number}")
+
+    def piece_type_at(self, square):
+        """Piece type on a square, or 0 if it is empty"""
+        return self.squares[square]
+
+    def pieces_mask(self, piece_type, color):
+        """Bitboard of one color's pieces of one type"""
+        return self.pieces[int(color)][piece_type]
+
+    def piece_count(self):
+        """Number of pieces on the board"""
+        return (self.occupied_co[WHITE] | self.occupied_co[BLACK]).bit_count()
+
+    def is_attacked(self, square, by_color):
+        """Whether any piece of by_color attacks the square"""
+        pieces = self.pieces[by_color]
+        if KNIGHT_ATTACKS[square] & pieces[KNIGHT]:
+            return True
+        if KING_ATTACKS[square] & pieces[KING]:
+            return True
+        if PAWN_ATTACKS[by_color ^ 1][square] & pieces[PAWN]:
+            return True
+        occupied = self.occupied_co[WHITE] | self.occupied_co[BLACK]
+        queens = pieces[QUEEN]
+        if DIAG_ATTACKS[square][DIAG_MASKS[square] & occupied] & (pieces[BISHOP] | queens):
+            return True
+        straight = pieces[ROOK] | queens
+        if straight and (FILE_ATTACKS[square][FILE_MASKS[square] & occupied] & straight or
+                         RANK_ATTACKS[square][RANK_MASKS[square] & occupied] & straight):
+            return True
+        return False
+
+    def is_check(self):
+        """Whether the side to move is in check"""
+        king = self.pieces[self.turn][KING]
+        return bool(king) and self.is_attacked(king.bit_length() - 1, self.turn ^ 1)
+
+    def is_repetition(self):
+        """Whether the position already occurred since the last irreversible move"""
+        keys = self.keys
+        key = self.key
+        index = self.history_length + self.ply
+        stop = max(0, index - self.halfmove_clock)
+        index -= 4
+        while index >= stop:
+            if keys[index] == key:
+                return True
+            index -= 2
+        return False
+
+    def is_insufficient_material(self):
+        """Whether neither side can possibly mate (bare kings plus at most one minor)"""
+        white, black = self.pieces[WHITE], self.pieces[BLACK]
+        if white[PAWN] | black[PAWN] | white[ROOK] | black[ROOK] | white[QUEEN] | black[QUEEN]:
+            return False
+        return (white[KNIGHT] | black[KNIGHT] | white[BISHOP] | black[BISHOP]).bit_count() <= 1
+
+    def generate_moves(self):
+        """List the pseudo-legal moves of the side to move"""
+        moves = []
+        append = moves.append
+        us = self.turn
+        pieces = self.pieces[us]
+        own = self.occupied_co[us]
+        enemy = self.occupied_co[us ^ 1]
+        occupied = own | enemy
+        targets = ~own & BB_ALL
+
+        # Pawns, generated set-wise
+        pawns = pieces[PAWN]
+        if pawns:
+            if us == WHITE:
+                single = (pawns << 8) & ~occupied & BB_ALL
+                double = ((single & chess.BB_RANK_3) << 8) & ~occupied
+                push, promotion_rank = 8, chess.BB_RANK_8
+            else:
+                single = (pawns >> 8) & ~occupied
+                double = ((single & chess.BB_RANK_6) >> 8) & ~occupied
+                push, promotion_rank = -8, chess.BB_RANK_1
+
+            capture_targets = enemy
+            if self.ep_square >= 0:
+                capture_targets |= BB_SQUARES[self.ep_square]
+            pawn_attacks = PAWN_ATTACKS[us]
+            mask = pawns
+            while mask:
+                lowest = mask & -mask
+                from_square = lowest.bit_length() - 1
+                mask ^= lowest
+                attacks = pawn_attacks[from_square] & capture_targets
+                while attacks:
+                    hit = attacks & -attacks
+                    attacks ^= hit
+                    to_square = hit.bit_length() - 1
+                    if hit & promotion_rank:
+                        for promotion in (QUEEN, KNIGHT, ROOK, BISHOP):
+                            append(from_square | to_square << 6 | promotion << PROMOTION_SHIFT)
+                    else:
+                        append(from_square | to_square << 6)
+
+            while single:
+                lowest = single & -single
+                single ^= lowest
+                to_square = lowest.bit_length() - 1
+                from_square = to_square - push
+                if lowest & promotion_rank:
+                    for promotion in (QUEEN, KNIGHT, ROOK, BISHOP):
+                        append(from_square | to_square << 6 | promotion << PROMOTION_SHIFT)
+                else:
+                    append(from_square | to_square << 6)
+
+            while double:
+                lowest = double & -double
+                double ^= lowest
+                to_square = lowest.bit_length() - 1
+                append((to_square - 2 * push) | to_square << 6)
+
+        # Pieces
+        for piece_type in (KNIGHT, BISHOP, ROOK, QUEEN, KING):
+            mask = pieces[piece_type]
+            while mask:
+                lowest = mask & -mask
+                from_square = lowest.bit_length() - 1
+                mask ^= lowest
+                if piece_type == KNIGHT:
+                    attacks = KNIGHT_ATTACKS[from_square]
+                elif piece_type == KING:
+                    attacks = KING_ATTACKS[from_square]
+                else:
+                    attacks = 0
+                    if piece_type != ROOK:
+                        attacks = DIAG_ATTACKS[from_square][DIAG_MASKS[from_square] & occupied]
+                    if piece_type != BISHOP:
+                        attacks |= (FILE_ATTACKS[from_square][FILE_MASKS[from_square] & occupied] |
+                                    RANK_ATTACKS[from_square][RANK_MASKS[from_square] & occupied])
+                attacks &= targets
+                while attacks:
+                    hit = attacks & -attacks
+                    attacks ^= hit
+                    append(from_square | (hit.bit_length() - 1) << 6)
+
+        # Castling; the king may not castle out of, through or into check
+        castling = self.castling
+        if castling:
+            them = us ^ 1
+            if us == WHITE:
+                king, kingside, queenside = chess.E1, WHITE_KINGSIDE, WHITE_QUEENSIDE
+            else:
+                king, kingside, queenside = chess.E8, BLACK_KINGSIDE, BLACK_QUEENSIDE
+            if castling & (kingside | queenside) and not self.is_attacked(king, them):
+                if (castling & kingside and
+                        not occupied & (BB_SQUARES[king + 1] | BB_SQUARES[king + 2]) and
+                        not self.is_attacked(king + 1, them) and not self.is_attacked(king + 2, them)):
+                    append(king | (king + 2) << 6)
+                if (castling & queenside and
+                        not occupied & (BB_SQUARES[king - 1] | BB_SQUARES[king - 2] | BB_SQUARES[king - 3]) and
+                        not self.is_attacked(king - 1, them) and not self.is_attacked(king - 2, them)):
+                    append(king | (king - 2) << 6)
+
+        return moves
+
+    def make(self, move):
+        """Play a pseudo-legal move
+
+        Returns False and leaves the position unchanged if the move would
+        leave the mover's king in check.
+        """
+        from_square = move & 63
+        to_square = (move >> 6) & 63
+        promotion = move >> PROMOTION_SHIFT
+        us = self.turn
+        them = us ^ 1
+        squares = self.squares
+        piece = squares[from_square]
+        captured = squares[to_square]
+
+        ply = self.ply
+        self.undo_move[ply] = move
+        self.undo_captured[ply] = captured
+        self.undo_castling[ply] = self.castling
+        self.undo_ep[ply] = self.ep_square
+        self.undo_halfmove[ply] = self.halfmove_clock
+        self.undo_key[ply] = self.key
+        self.undo_score[ply] = self.score
+
+        our_pieces = self.pieces[us]
+        their_pieces = self.pieces[them]
+        our_keys = ZOBRIST_PIECES[us]
+        our_scores = self.score_tables[us]
+        key = self.key ^ self.ep_key()
+        score = self.score
+        from_bb = BB_SQUARES[from_square]
+        to_bb = BB_SQUARES[to_square]
+
+        if captured:
+            their_pieces[captured] ^= to_bb
+            self.occupied_co[them] ^= to_bb
+            key ^= ZOBRIST_PIECES[them][captured][to_square]
+            score -= self.score_tables[them][captured][to_square]
+
+        our_pieces[piece] ^= from_bb | to_bb
+        self.occupied_co[us] ^= from_bb | to_bb
+        squares[from_square] = 0
+        squares[to_square] = piece
+        key ^= our_keys[piece][from_square] ^ our_keys[piece][to_square]
+        score += our_scores[piece][to_square] - our_scores[piece][from_square]
+
+        ep_square = -1
+        if piece == PAWN:
+            self.halfmove_clock = 0
+            if to_square == self.ep_square:
+                # En passant: the captured pawn sits behind the target square
+                victim = to_square - 8 if us == WHITE else to_square + 8
+                victim_bb = BB_SQUARES[victim]
+                their_pieces[PAWN] ^= victim_bb
+                self.occupied_co[them] ^= victim_bb
+                squares[victim] = 0
+                key ^= ZOBRIST_PIECES[them][PAWN][victim]
+                score -= self.score_tables[them][PAWN][victim]
+            elif to_square - from_square in (16, -16):
+                ep_square = (from_square + to_square) >> 1
+            elif promotion:
+                our_pieces[PAWN] ^= to_bb
+                our_pieces[promotion] |= to_bb
+                squares[to_square] = promotion
+                key ^= our_keys[PAWN][to_square] ^ our_keys[promotion][to_square]
+                score += our_scores[promotion][to_square] - our_scores[PAWN][to_square]
+        else:
+            self.halfmove_clock = 0 if captured else self.halfmove_clock + 1
+            if piece == KING and to_square - from_square in (2, -2):
+                # Castling: bring the rook over to the other side of the king
+                if to_square > from_square:
+                    rook_from, rook_to = from_square + 3, from_square + 1
+                else:
+                    rook_from, rook_to = from_square - 4, from_square - 1
+                rook_bb = BB_SQUARES[rook_from] | BB_SQUARES[rook_to]
+                our_pieces[ROOK] ^= rook_bb
+                self.occupied_co[us] ^= rook_bb
+                squares[rook_from] = 0
+                squares[rook_to] = ROOK
+                key ^= our_keys[ROOK][rook_from] ^ our_keys[ROOK][rook_to]
+                score += our_scores[ROOK][rook_to] - our_scores[ROOK][rook_from]
+
+        castling = self.castling & CASTLING_MASKS[from_square] & CASTLING_MASKS[to_square]
+        key ^= ZOBRIST_CASTLING[self.castling] ^ ZOBRIST_CASTLING[castling] ^ ZOBRIST_TURN
+        self.castling = castling
+        if us == BLACK:
+            self.fullmove_number += 1
+        self.turn = them
+        self.ep_square = ep_square
+        self.key = key ^ self.ep_key()
+        self.score = score
+        self.ply = ply + 1
+        self.keys[self.history_length + ply + 1] = self.key
+
+        king = our_pieces[KING]
+        if king and self.is_attacked(king.bit_length() - 1, them):
+            self.unmake()
+            return False
+        return True
+
+    def unmake(self):
+        """Take back the last move played with make()"""
+        ply = self.ply - 1
+        self.ply = ply
+        move = self.undo_move[ply]
+        captured = self.undo_captured[ply]
+        from_square = move & 63
+        to_square = (move >> 6) & 63
+        promotion = move >> PROMOTION_SHIFT
+        them = self.turn
+        us = them ^ 1
+        self.turn = us
+        if us == BLACK:
+            self.fullmove_number -= 1
+
+        squares = self.squares
+        our_pieces = self.pieces[us]
+        from_bb = BB_SQUARES[from_square]
+        to_bb = BB_SQUARES[to_square]
+
+        piece = squares[to_square]
+        if promotion:
+            our_pieces[promotion] ^= to_bb
+            our_pieces[PAWN] |= to_bb
+            piece = PAWN
+        our_pieces[piece] ^= from_bb | to_bb
+        self.occupied_co[us] ^= from_bb | to_bb
+        squares[from_square] = piece
+        squares[to_square] = captured
+
+        ep_square = self.undo_ep[ply]
+        if captured:
+            self.pieces[them][captured] |= to_bb
+            self.occupied_co[them] |= to_bb
+        elif piece == PAWN and to_square == ep_square:
+            victim = to_square - 8 if us == WHITE else to_square + 8
+            victim_bb = BB_SQUARES[victim]
+            self.pieces[them][PAWN] |= victim_bb
+            self.occupied_co[them] |= victim_bb
+            squares[victim] = PAWN
+        elif piece == KING and to_square - from_square in (2, -2):
+            if to_square > from_square:
+                rook_from, rook_to = from_square + 3, from_square + 1
+            else:
+                rook_from, rook_to = from_square - 4, from_square - 1
+            rook_bb = BB_SQUARES[rook_from] | BB_SQUARES[rook_to]
+            our_pieces[ROOK] ^= rook_bb
+            self.occupied_co[us] ^= rook_bb
+            squares[rook_to] = 0
+            squares[rook_from] = ROOK
+
+        self.castling = self.undo_castling[ply]
+        self.ep_square = ep_square
+        self.halfmove_clock = self.undo_halfmove[ply]
+        self.key = self.undo_key[ply]
+        self.score = self.undo_score[ply]
+
+    def legal_moves(self):
+        """List the legal moves of the side to move"""
+        legal = []
+        for move in self.generate_moves():
+            if self.make(move):
+                self.unmake()
+                legal.append(move)
+        return legal
+
+    def has_legal_move(self):
+        """Whether the side to move has any legal move"""
+        for move in self.generate_moves():
+            if self.make(move):
+                self.unmake()
+                return True
+        return False
+
+    def perft(self, depth):
+        """Count leaf nodes of the legal move tree to the given depth"""
+        if depth == 0:
+            return 1
+        nodes = 0
+        for move in self.generate_moves():
+            if self.make(move):
+                nodes += self.perft(depth - 1) if depth > 1 else 1
+                self.unmake()
+        return nodes
+
+def compare_with_python_chess(board, depth):
+    """Walk the move tree alongside a chess.Board and check they agree
+
+    At every node the legal move sets and Zobrist keys must match those of
+    python-chess. Returns the perft node count; raises AssertionError on
+    the first difference.
+    """
+    board = board.copy()
+    search_board = SearchBoard(board)
+
+    def walk(depth):
+        assert search_board.key == chess.polyglot.zobrist_hash(board), board.fen()
+        ours = sorted(search_board.legal_moves())
+        theirs = sorted(move_from_chess(move) for move in board.legal_moves)
+        assert ours == theirs, board.fen()
+        if depth == 0:
+            return 1
+        nodes = 0
+        for move in ours:
+            search_board.make(move)
+            board.push(move_to_chess(move))
+            nodes += walk(depth - 1)
+            board.pop()
+            search_board.unmake()
+        return nodes
+
+    return walk(depth)
+
+# Well-known perft positions with their node counts at depth 1-4
+PERFT_POSITIONS = [
+    (chess.STARTING_FEN, [20, 400, 8902, 197281]),
+    ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", [48, 2039, 97862, 4085603]),
+    ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812, 43238]),
+    ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", [6, 264, 9467, 422333]),
+    ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", [44, 1486, 62379, 2103487]),
+]
+
+if __name__ == "__main__":
+    # Perft parity check against python-chess and the published node counts
+    import sys
+    import time
+
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    for fen, expected in PERFT_POSITIONS:
+        board = chess.Board(fen)
+        compare_with_python_chess(board, min(depth, 2))
+
+        start = time.perf_counter()
+        nodes = SearchBoard(board).perft(depth)
+        elapsed = time.perf_counter() - start
+        status = "ok" if depth > len(expected) or nodes == expected[depth - 1] else "MISMATCH"
+        print(f"{status:8} depth {depth} {nodes:>9} nodes {nodes / elapsed:>10.0f} nps  {fen}")
@@ -0,0 +1,162 @@
+import os
+import sqlite3
+import time
+
+# SQLite file shared by every AI worker process; empty disables the cache
+SEARCH_CACHE_PATH = os.environ.get('AI_CACHE_PATH', 'search_cache.db')
+
+# Most results kept on disk; the least recently used are evicted past this
+SEARCH_CACHE_ENTRIES = int(os.environ.get('AI_CACHE_ENTRIES', 200000))
+
+# Most recently used results each process loads into memory when it opens the cache
+SEARCH_CACHE_WARM = int(os.environ.get('AI_CACHE_WARM', 20000))
+
+# Inserts between eviction passes
+EVICT_INTERVAL = 500
+
+# Bump whenever the evaluation or search changes, so old results are not reused
+SEARCH_CACHE_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_results (
+    zobrist INTEGER NOT NULL,
+    settings TEXT NOT NULL,
+    depth INTEGER NOT NULL,
+    best_move INTEGER NOT NULL,
+    score REAL,
+    nodes INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (zobrist, settings, depth)
+);
+CREATE INDEX IF NOT EXISTS search_results_by_use ON search_results (last_used);
+"""
+
+def to_signed(key):
+    """Zobrist keys are unsigned 64-bit; SQLite integers are signed"""
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+class SearchCache:
+    """Search results shared between games, processes and restarts
+
+    A result is the best move and score of a completed search of a
+    position to some depth. Because the iteration finished, its result does
+    not depend on the time or node budget that allowed it. Results are
+    keyed by the position's Zobrist key, the search settings that do change
+    them (settings) and that depth, and a lookup accepts any result at least
+    as deep as asked for. So every level that searches to the same depth
+    shares entries.
+
+    The results live in a SQLite database in WAL mode, which any number of
+    worker processes can read and write at once. Each process keeps the
+    results it has used in memory, starting with the most recently used
+    ones in the database, so a restarted bot begins warm. Past max_entries
+    the least recently used results are evicted from the database.
+    """
+
+    def __init__(self, path=SEARCH_CACHE_PATH, max_entries=SEARCH_CACHE_ENTRIES, warm=SEARCH_CACHE_WARM):
+        self.path = path
+        self.max_entries = max_entries
+        self.warm_entries = warm
+        self.connection = None
+        self.inserts = 0
+
+        # Key: (zobrist key, settings)
+        # Value: (depth, best move, score, nodes), the deepest result known
+        self.memory = {}
+
+    def open(self):
+        self.connection = sqlite3.connect(self.path, timeout=5)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+        self.warm()
+
+    def warm(self):
+        """Load the most recently used results into memory"""
+        rows = self.connection.execute(
+            'SELECT zobrist, settings, depth, best_move, score, nodes FROM '
+            '(SELECT * FROM search_results ORDER BY last_used DESC LIMIT ?) ORDER BY last_used',
+            (self.warm_entries,)).fetchall()
+        for zobrist, settings, depth, best_move, score, nodes in rows:
+            self._remember((zobrist, settings), (depth, best_move, score, nodes))
+
+    def _remember(self, key, result):
+        """Keep the deeper of a result and the one already in memory, as most recently used"""
+        old = self.memory.pop(key, None)
+        if old is not None and old[0] > result[0]:
+            result = old
+        while self.memory and len(self.memory) >= self.warm_entries:
+            # Dicts keep insertion order, so the first key is the least recently used
+            del self.memory[next(iter(self.memory))]
+        self.memory[key] = result
+
+    def get(self, zobrist, settings, depth):
+        """Get (depth, best move, score, nodes) of a search at least depth deep, or None"""
+        key = (to_signed(zobrist), settings)
+        result = self.memory.get(key)
+        try:
+            if result is None or result[0] < depth:
+                result = self.connection.execute(
+                    'SELECT depth, best_move, score, nodes FROM search_results '
+                    'WHERE zobrist = ? AND settings = ? AND depth >= ? ORDER BY depth DESC LIMIT 1',
+                    (key[0], settings, depth)).fetchone()
+                if result is None:
+                    return None
+            # Keep the result from being evicted while it is in use
+            with self.connection:
+                self.connection.execute(
+                    'UPDATE search_results SET last_used = ? WHERE zobrist = ? AND settings = ? AND depth = ?',
+                    (time.time(), key[0], settings, result[0]))
+        except sqlite3.Error as e:
+            print(f"Error reading search cache: {e}")
+            return None
+        self._remember(key, result)
+        return result
+
+    def put(self, zobrist, settings, depth, best_move, score, nodes):
+        """Store the result of a completed search"""
+        key = (to_signed(zobrist), settings)
+        self._remember(key, (depth, best_move, score, nodes))
+        try:
+            with self.connection:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO search_results VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (key[0], settings, depth, best_move, score, nodes, time.time()))
+            self.inserts += 1
+            if self.inserts % EVICT_INTERVAL == 0:
+                self.evict()
+        except sqlite3.Error as e:
+            print(f"Error writing search cache: {e}")
+
+    def evict(self):
+        """Delete the least recently used results past max_entries"""
+        with self.connection:
+            count = self.connection.execute('SELECT COUNT(*) FROM search_results').fetchone()[0]
+            if count > self.max_entries:
+                self.connection.execute(
+                    'DELETE FROM search_results WHERE rowid IN '
+                    '(SELECT rowid FROM search_results ORDER BY last_used LIMIT ?)',
+                    (count - self.max_entries,))
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+# Cache shared by every SimpleAI in the process, opened on first use
+_search_cache = None
+_search_cache_loaded = False
+
+def get_search_cache():
+    """Get the process's SearchCache, or None if it is disabled or cannot be opened"""
+    global _search_cache, _search_cache_loaded
+    if not _search_cache_loaded:
+        _search_cache_loaded = True
+        if SEARCH_CACHE_PATH:
+            try:
+                cache = SearchCache()
+                cache.open()
+                _search_cache = cache
+            except Exception as e:
+                print(f"Error opening search cache: {e}")
+    return _search_cache
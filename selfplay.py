@@ -0,0 +1,238 @@
+"""Self-play matches between AI difficulty levels, for calibrating them
+
+Run with `python selfplay.py`. Each level plays the levels up to --spread
+above it, --games games per pairing with colours alternating, in
+parallel worker processes. Every level uses its own time and node budget
+from get_difficulty_settings, exactly as in the bot. The games are written
+as PGN with each move's time, depth, nodes and source in its comment. The
+per-move data and an Elo-vs-latency table are written as JSON. The table
+is also printed, so the levels can be tuned to a target response time.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import chess
+import chess.pgn
+
+import chess_ai
+import search_cache
+from chess_ai import SimpleAI, get_difficulty_settings
+
+# Games still running after this many plies are adjudicated as draws
+MAX_PLIES = 200
+
+def _init_worker(use_book, use_cache):
+    """Worker initializer: optionally turn off the opening book and the shared search cache"""
+    if not use_book:
+        chess_ai.BOOK_PATH = ''
+    if not use_cache:
+        search_cache.SEARCH_CACHE_PATH = ''
+
+def play_game(index, white_level, black_level, seed, max_plies=MAX_PLIES):
+    """Play one game between two levels; returns its PGN text and per-move data"""
+    random.seed(seed)
+    players = {chess.WHITE: SimpleAI(white_level), chess.BLACK: SimpleAI(black_level)}
+    board = chess.Board()
+    moves = []
+
+    while not board.is_game_over(claim_draw=True) and len(board.move_stack) < max_plies:
+        ai = players[board.turn]
+        start = time.perf_counter()
+        move = ai.get_best_move(board)
+        elapsed = time.perf_counter() - start
+        moves.append({
+            'level': ai.level,
+            'move': move.uci(),
+            'time': elapsed,
+            'depth': ai.stats['depth'],
+            'nodes': ai.stats['nodes'],
+            'source': ai.stats['source'],
+        })
+        board.push(move)
+
+    if board.is_game_over(claim_draw=True):
+        result = board.result(claim_draw=True)
+        termination = 'normal'
+    else:
+        result = '1/2-1/2'
+        termination = 'adjudication'
+
+    game = chess.pgn.Game()
+    game.headers['Event'] = "ChessZ self-play"
+    game.headers['Date'] = time.strftime('%Y.%m.%d')
+    game.headers['Round'] = str(index + 1)
+    game.headers['White'] = f"SimpleAI level {white_level}"
+    game.headers['Black'] = f"SimpleAI level {black_level}"
+    game.headers['Result'] = result
+    game.headers['Termination'] = termination
+    node = game
+    for move_data in moves:
+        node = node.add_variation(chess.Move.from_uci(move_data['move']))
+        node.comment = (f"[%emt {move_data['time']:.3f}] depth {move_data['depth']}, "
+                        f"{move_data['nodes']} nodes, {move_data['source']}")
+
+    return {
+        'index': index,
+        'white': white_level,
+        'black': black_level,
+        'result': result,
+        'termination': termination,
+        'moves': moves,
+        'pgn': str(game),
+    }
+
+def pairings(levels, spread, games):
+    """(white level, black level) for every game, colours alternating within a pairing"""
+    schedule = []
+    for i, low in enumerate(levels):
+        for high in levels[i + 1:i + 1 + spread]:
+            for game in range(games):
+                schedule.append((low, high) if game % 2 == 0 else (high, low))
+    return schedule
+
+def elo_ratings(levels, results):
+    """Maximum-likelihood Elo ratings from game results, the lowest level at 0
+
+    Fits a Bradley-Terry model with draws counted as half a win each way.
+    One virtual draw between neighbouring levels keeps the ratings finite
+    when a level wins or loses every game.
+    """
+    # Key: (level, opponent level)
+    # Value: points the level scored against the opponent
+    points = {}
+    for a, b in zip(levels, levels[1:]):
+        points[a, b] = points.get((a, b), 0) + 0.5
+        points[b, a] = points.get((b, a), 0) + 0.5
+    for game in results:
+        white_points = {'1-0': 1.0, '0-1': 0.0}.get(game['result'], 0.5)
+        white, black = game['white'], game['black']
+        points[white, black] = points.get((white, black), 0) + white_points
+        points[black, white] = points.get((black, white), 0) + 1 - white_points
+
+    strength = {level: 1.0 for level in levels}
+    for _ in range(1000):
+        updated = {}
+        for level in levels:
+            wins = sum(score for (player, _), score in points.items() if player == level)
+            denominator = 0.0
+            for (player, opponent), score in points.items():
+                if player == level:
+                    played = score + points[opponent, player]
+                    denominator += played / (strength[level] + strength[opponent])
+            updated[level] = wins / denominator
+        # Rescale so the lowest level stays at 1 (0 Elo)
+        base = updated[levels[0]]
+        updated = {level: value / base for level, value in updated.items()}
+        converged = max(abs(math.log(updated[level] / strength[level])) for level in levels) < 1e-9
+        strength = updated
+        if converged:
+            break
+
+    return {level: 400 * math.log10(strength[level]) for level in levels}
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def level_table(levels, results, target=None):
+    """One row per level: rating, score and the cost of its moves"""
+    ratings = elo_ratings(levels, results)
+    rows = []
+    for level in levels:
+        games = [game for game in results if level in (game['white'], game['black'])]
+        score = sum({'1-0': 1.0, '0-1': 0.0}.get(game['result'], 0.5) if game['white'] == level
+                    else {'1-0': 0.0, '0-1': 1.0}.get(game['result'], 0.5) for game in games)
+        moves = [move for game in games for move in game['moves'] if move['level'] == level]
+        searched = [move for move in moves if move['source'] == 'search']
+        times = [move['time'] for move in moves] or [0.0]
+        settings = get_difficulty_settings(level)
+        rows.append({
+            'level': level,
+            'elo': round(ratings[level]),
+            'games': len(games),
+            'score': score / len(games) if games else None,
+            'moves': len(moves),
+            'mean_time': statistics.fmean(times),
+            'p50_time': percentile(times, 0.5),
+            'p95_time': percentile(times, 0.95),
+            'max_time': max(times),
+            'mean_depth': statistics.fmean(move['depth'] for move in searched) if searched else 0,
+            'mean_nodes': statistics.fmean(move['nodes'] for move in searched) if searched else 0,
+            'depth_setting': settings['depth'],
+            'time_limit': settings['time_limit'],
+            'over_target': target is not None and percentile(times, 0.95) > target,
+        })
+    return rows
+
+def print_table(rows, target=None):
+    print(f"{'level':>5} {'elo':>6} {'games':>5} {'score':>6} {'mean s':>7} {'p50 s':>7} {'p95 s':>7} "
+          f"{'depth':>5} {'nodes':>8} {'limit s':>7}")
+    for row in rows:
+        score = f"{row['score']:.0%}" if row['score'] is not None else '-'
+        flag = '  over target' if row['over_target'] else ''
+        print(f"{row['level']:>5} {row['elo']:>6} {row['games']:>5} {score:>6} {row['mean_time']:>7.3f} "
+              f"{row['p50_time']:>7.3f} {row['p95_time']:>7.3f} {row['mean_depth']:>5.1f} "
+              f"{row['mean_nodes']:>8.0f} {row['time_limit']:>7.2f}{flag}")
+    if target is not None:
+        print(f"Target: p95 move time under {target:.2f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--levels', default='1-20', help="levels to play, e.g. 1-20 or 1,5,10,15,20")
+    parser.add_argument('--spread', type=int, default=2, help="how many higher levels each level plays")
+    parser.add_argument('--games', type=int, default=2, help="games per pairing")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument('--max-plies', type=int, default=MAX_PLIES, help="adjudicate a draw after this many plies")
+    parser.add_argument('--target', type=float, help="target p95 move time in seconds; slower levels are flagged")
+    parser.add_argument('--seed', type=int, default=0, help="random seed for the first game")
+    parser.add_argument('--no-book', action='store_true', help="don't use the opening book")
+    parser.add_argument('--use-cache', action='store_true', help="use the shared search cache (hides search cost)")
+    parser.add_argument('--output', default='selfplay', help="write OUTPUT.pgn and OUTPUT.json")
+    args = parser.parse_args()
+
+    if '-' in args.levels:
+        first, last = map(int, args.levels.split('-'))
+        levels = list(range(first, last + 1))
+    else:
+        levels = sorted(int(level) for level in args.levels.split(','))
+    if len(levels) < 2:
+        parser.error("--levels needs at least two levels to play each other")
+
+    schedule = pairings(levels, args.spread, args.games)
+    print(f"Playing {len(schedule)} games between levels {levels[0]}-{levels[-1]} on {args.workers} workers...")
+
+    results = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(args.workers, initializer=_init_worker,
+                             initargs=(not args.no_book, args.use_cache)) as executor:
+        futures = [executor.submit(play_game, index, white, black, args.seed + index, args.max_plies)
+                   for index, (white, black) in enumerate(schedule)]
+        for future in as_completed(futures):
+            game = future.result()
+            results.append(game)
+            print(f"  [{len(results)}/{len(schedule)}] level {game['white']} vs level {game['black']}: "
+                  f"{game['result']} in {len(game['moves'])} plies")
+    results.sort(key=lambda game: game['index'])
+    print(f"Done in {time.perf_counter() - start:.1f}s")
+
+    rows = level_table(levels, results, args.target)
+    print_table(rows, args.target)
+
+    with open(f"{args.output}.pgn", 'w') as f:
+        f.write('\n\n'.join(game['pgn'] for game in results) + '\n')
+    with open(f"{args.output}.json", 'w') as f:
+        json.dump({
+            'levels': rows,
+            'games': [{key: value for key, value in game.items() if key != 'pgn'} for game in results],
+            'settings': vars(args),
+        }, f, indent=2)
+    print(f"Wrote {args.output}.pgn and {args.output}.json")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Run the bot as several processes, each owning a slice of the gateway shards
+
+    python sharding.py
+
+SHARD_COUNT gateway shards (default: one per CPU) are split round-robin
+over SHARD_PROCESSES processes (default: one per shard). Each process runs
+chess_bot.py as an AutoShardedBot for its own shards. Games are kept in
+the shared SQLite database (GAME_DB_PATH), where each channel belongs to
+the shard of its guild. A process that crashes is restarted and resumes
+its shards' games. Process N serves keep_alive on PORT + 1 + N; this
+supervisor keeps PORT.
+"""
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from keep_alive import keep_alive
+
+SHARD_COUNT = int(os.environ.get('SHARD_COUNT', os.cpu_count() or 1))
+SHARD_PROCESSES = min(SHARD_COUNT, int(os.environ.get('SHARD_PROCESSES', SHARD_COUNT)))
+
+# Restart delay after a crash, doubling up to the maximum while a process keeps crashing
+RESTART_DELAY = 1
+MAX_RESTART_DELAY = 60
+
+# A process that ran this long before exiting is considered to have been healthy
+STABLE_SECONDS = 60
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chess_bot.py')
+
+def shard_slices(shard_count, processes):
+    """Split shard IDs round-robin over processes"""
+    return [list(range(index, shard_count, processes)) for index in range(processes)]
+
+class ShardProcess:
+    """One bot process and its restart bookkeeping"""
+
+    def __init__(self, index, shard_ids):
+        self.index = index
+        self.shard_ids = shard_ids
+        self.process = None
+        self.started = 0
+        self.restart_delay = RESTART_DELAY
+        self.restart_at = 0
+
+    def start(self):
+        env = dict(os.environ)
+        env['SHARD_IDS'] = ','.join(map(str, self.shard_ids))
+        env['SHARD_COUNT'] = str(SHARD_COUNT)
+        env['GAME_STORE'] = 'sqlite'
+        env['PORT'] = str(int(os.environ.get('PORT', 8080)) + 1 + self.index)
+        # Share the CPUs between the processes' AI workers; the /analyze
+        # workers come on top of them at a lower priority
+        env.setdefault('AI_WORKERS', str(max(1, (os.cpu_count() or 1) // SHARD_PROCESSES)))
+        env.setdefault('ANALYSIS_WORKERS', str(max(1, int(env['AI_WORKERS']) // 2)))
+
+        self.process = subprocess.Popen([sys.executable, BOT_SCRIPT], env=env)
+        self.started = time.monotonic()
+        print(f"Started shard process {self.index} (pid {self.process.pid}) for shards {self.shard_ids}")
+
+    def check(self):
+        """Restart the process if it has exited"""
+        if self.process is not None:
+            code = self.process.poll()
+            if code is None:
+                return
+            ran_for = time.monotonic() - self.started
+            self.restart_delay = RESTART_DELAY if ran_for > STABLE_SECONDS else min(
+                self.restart_delay * 2, MAX_RESTART_DELAY)
+            print(f"Shard process {self.index} exited with code {code}; restarting in {self.restart_delay}s")
+            self.process = None
+            self.restart_at = time.monotonic() + self.restart_delay
+
+        if time.monotonic() >= self.restart_at:
+            self.start()
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+def main():
+    if not os.environ.get('DISCORD_BOT_TOKEN'):
+        print("❌ DISCORD_BOT_TOKEN environment variable not set!")
+        sys.exit(1)
+
+    # Turn SIGTERM (e.g. from the host) into a clean shutdown of every process
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    keep_alive()
+    processes = [ShardProcess(index, shard_ids)
+                 for index, shard_ids in enumerate(shard_slices(SHARD_COUNT, SHARD_PROCESSES))]
+    print(f"🤖 Starting {SHARD_COUNT} shards in {SHARD_PROCESSES} processes...")
+    try:
+        for process in processes:
+            process.start()
+        while True:
+            time.sleep(1)
+            for process in processes:
+                process.check()
+    finally:
+        for process in processes:
+            process.stop()
+
+if __name__ == "__main__":
+    main()
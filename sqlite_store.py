@@ -0,0 +1,117 @@
+import json
+import os
+import sqlite3
+
+import metrics
+from game_store import GameStore, moves_from_bytes, moves_to_bytes
+
+# Database shared by every shard process on the machine
+GAME_DB_PATH = os.environ.get('GAME_DB_PATH', 'games.db')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    channel_id INTEGER PRIMARY KEY,
+    guild_id INTEGER,
+    start_fen TEXT NOT NULL,
+    moves BLOB NOT NULL,
+    players TEXT NOT NULL,
+    type TEXT NOT NULL,
+    difficulty INTEGER
+);
+"""
+
+def connect(path):
+    """Open the database in WAL mode so shard processes can read and write at once"""
+    connection = sqlite3.connect(path, timeout=30)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.executescript(SCHEMA)
+    return connection
+
+class SQLiteGameStore(GameStore):
+    """GameStore backed by one SQLite database shared by several bot processes
+
+    Every game row records the guild of its channel, and a process only
+    loads and writes the games whose guild belongs to one of its shards
+    under the current shard_count (DMs belong to shard 0). That keeps
+    processes from stepping on each other. A restarted process picks up
+    exactly the games of the shards it was given, even if the number of
+    shards has changed.
+
+    Records are applied to the in-memory copy as with GameStore. The writer
+    thread then rewrites the rows of the channels touched by each batch in
+    a single transaction. A move costs one small row update no matter how
+    many games exist, and nothing needs compacting.
+    """
+
+    def __init__(self, path=GAME_DB_PATH, shard_ids=None, shard_count=1):
+        super().__init__()
+        self.path = path
+        self.shard_ids = None if shard_ids is None else set(shard_ids)
+        self.shard_count = max(1, shard_count)
+
+    def load(self):
+        """Read this process's games from the database; returns the games by channel ID"""
+        query = 'SELECT channel_id, guild_id, start_fen, moves, players, type, difficulty FROM games'
+        params = ()
+        if self.shard_ids is not None:
+            # Discord's shard formula: (guild_id >> 22) % shard_count
+            shard_ids = sorted(self.shard_ids)
+            params = (self.shard_count, *shard_ids)
+            query += (" WHERE (CASE WHEN guild_id IS NULL THEN 0 ELSE (guild_id >> 22) % ? END)"
+                      f" IN ({', '.join('?' * len(shard_ids))})")
+
+        connection = connect(self.path)
+        try:
+            rows = connection.execute(query, params).fetchall()
+        finally:
+            connection.close()
+
+        games = {}
+        for channel_id, guild_id, start_fen, moves, players, game_type, difficulty in rows:
+            games[channel_id] = {
+                'start_fen': start_fen,
+                'moves': moves_from_bytes(moves),
+                'players': tuple(json.loads(players)),
+                'type': game_type,
+                'difficulty': difficulty,
+                'guild_id': guild_id
+            }
+        return games
+
+    def _run(self):
+        """Writer thread: write the rows touched by each batch of records"""
+        connection = connect(self.path)
+        # Channels whose rows a failed write left out of date
+        unsaved = set()
+        running = True
+        while running:
+            records, running = self._next_batch()
+            if not records and not unsaved:
+                continue
+
+            # Current state of every channel the batch touched
+            channel_ids = unsaved | {record['c'] for record in records}
+            updated = []
+            ended = []
+            with self.lock:
+                for channel_id in channel_ids:
+                    game = self.games.get(channel_id)
+                    if game is None:
+                        ended.append((channel_id,))
+                    else:
+                        updated.append((channel_id, game.get('guild_id'), game['start_fen'],
+                                        moves_to_bytes(game['moves']), json.dumps(list(game['players'])),
+                                        game['type'], game.get('difficulty')))
+
+            try:
+                with metrics.PERSIST_WRITE_SECONDS.time():
+                    with connection:
+                        connection.executemany('DELETE FROM games WHERE channel_id = ?', ended)
+                        connection.executemany('INSERT OR REPLACE INTO games VALUES (?, ?, ?, ?, ?, ?, ?)', updated)
+                metrics.PERSIST_RECORDS.inc(amount=len(records))
+                unsaved = set()
+            except Exception as e:
+                print(f"Error saving games: {e}")
+                unsaved = channel_ids
+        connection.close()